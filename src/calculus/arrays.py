@@ -0,0 +1,153 @@
+#! /usr/bin/env python3
+
+from __future__ import annotations
+from typing import Dict, List, Tuple
+
+import numpy as np
+from multiset import FrozenMultiset as multiset
+
+from calculus import CanonicalAgent, Sigma, Solo, counters
+
+
+class SoloArray:
+
+    def __init__(self, names: List[str], subjects: np.ndarray, parities: np.ndarray,
+                 arities: np.ndarray, objects: np.ndarray, bound: np.ndarray) -> None:
+        self.names = names
+        self.subjects = subjects
+        self.parities = parities
+        self.arities = arities
+        self.objects = objects
+        self.bound = bound
+        self.renaming = np.arange(len(names))
+
+
+    def __len__(self) -> int:
+        return len(self.subjects)
+
+
+    @classmethod
+    def from_agent(cls, agent: CanonicalAgent) -> SoloArray:
+        index: Dict[str, int] = {}
+        names: List[str] = []
+
+        def intern(name: str) -> int:
+            if name not in index:
+                index[name] = len(names)
+                names.append(name)
+            return index[name]
+
+        solos = list(agent.solos)
+        subjects = np.fromiter((intern(solo.subject) for solo in solos),
+                               dtype=np.int64, count=len(solos))
+        parities = np.fromiter((solo.parity for solo in solos), dtype=bool, count=len(solos))
+        arities = np.fromiter((solo.arity for solo in solos), dtype=np.int64, count=len(solos))
+        flat = np.fromiter((intern(name) for solo in solos for name in solo.objects),
+                           dtype=np.int64, count=int(arities.sum()))
+        objects = np.full((len(solos), int(arities.max(initial=0))), -1, dtype=np.int64)
+        rows = np.repeat(np.arange(len(solos)), arities)
+        columns = np.arange(len(flat)) - np.repeat(np.cumsum(arities) - arities, arities)
+        objects[rows, columns] = flat
+        scope = [intern(name) for name in agent.scope]
+        bound = np.zeros(len(names), dtype=bool)
+        bound[scope] = True
+        return cls(names, subjects, parities, arities, objects, bound)
+
+
+    def to_agent(self, agent: CanonicalAgent) -> CanonicalAgent:
+        names = np.array(self.names, dtype=object)
+        solos = multiset(Solo(subject, tuple(objects[:arity]), parity)
+                         for subject, parity, arity, objects in zip(names[self.subjects],
+                                                                    self.parities.tolist(),
+                                                                    self.arities.tolist(),
+                                                                    names[self.objects]))
+        fused = np.flatnonzero(self.renaming != np.arange(len(self.names)))
+        replicators = agent.replicators
+        if len(fused) and replicators:
+            sigma = Sigma(zip(names[fused], names[self.renaming[fused]]))
+            replicators = sigma(CanonicalAgent((agent.scope, multiset(), replicators))).replicators
+        return CanonicalAgent((frozenset(names[self.bound]), solos, replicators))
+
+
+    def redexes(self) -> Tuple[np.ndarray, np.ndarray]:
+        order = np.lexsort((self.parities, self.arities, self.subjects))
+        subjects, arities = self.subjects[order], self.arities[order]
+        change = np.ones(len(order), dtype=bool)
+        change[1:] = (subjects[1:] != subjects[:-1]) | (arities[1:] != arities[:-1])
+        starts = np.flatnonzero(change)
+        sizes = np.diff(np.append(starts, len(order)))
+        outputs = np.add.reduceat((~self.parities[order]).astype(np.int64), starts) \
+            if len(order) else starts
+        pairs = np.minimum(outputs, sizes - outputs)
+        offsets = np.arange(pairs.sum()) - np.repeat(np.cumsum(pairs) - pairs, pairs)
+        inputs = order[np.repeat(starts + outputs, pairs) + offsets]
+        outputs = order[np.repeat(starts, pairs) + offsets]
+        nontrivial = (self.objects[inputs] != self.objects[outputs]).any(axis=1)
+        return inputs[nontrivial], outputs[nontrivial]
+
+
+    def fuse(self) -> int:
+        inputs, outputs = self.redexes()
+        if not len(inputs):
+            return 0
+
+        # NOTE: redexes sharing a name they fuse could trivialise each other, keep the first,
+        #       a name matched with itself is left alone and cannot conflict
+        pairs = np.arange(len(inputs))
+        names = np.concatenate([self.objects[inputs], self.objects[outputs]], axis=1)
+        differs = self.objects[inputs] != self.objects[outputs]
+        valid = (names >= 0) & np.concatenate([differs, differs], axis=1)
+        owner = np.full(len(self.names), len(pairs))
+        np.minimum.at(owner, names[valid], np.broadcast_to(pairs[:, None], names.shape)[valid])
+        selected = np.where(valid, owner[names] == pairs[:, None], True).all(axis=1)
+        inputs, outputs = inputs[selected], outputs[selected]
+
+        valid = self.objects[inputs] >= 0
+        a, b = self.objects[inputs][valid], self.objects[outputs][valid]
+        labels = np.arange(len(self.names))
+        while True:
+            previous = labels.copy()
+            np.minimum.at(labels, a, labels[b])
+            np.minimum.at(labels, b, labels[a])
+            labels = labels[labels]
+            if np.array_equal(labels, previous):
+                break
+
+        touched = np.unique(np.concatenate([a, b]))
+        free = touched[~self.bound[touched]]
+        conflicts = np.bincount(labels[free], minlength=len(self.names)) > 1
+        rejected = conflicts[labels[self.objects[inputs]]].any(axis=1, where=valid)
+        if rejected.all():
+            return 0
+        rejected_names = np.concatenate([self.objects[inputs[rejected]].ravel(),
+                                         self.objects[outputs[rejected]].ravel()])
+        rejected_names = rejected_names[rejected_names >= 0]
+
+        representatives = np.full(len(self.names), -1)
+        representatives[labels[free]] = free
+        lookup = np.where(representatives[labels] >= 0, representatives[labels], labels)
+        lookup[rejected_names] = rejected_names
+
+        keep = np.ones(len(self), dtype=bool)
+        keep[inputs[~rejected]] = False
+        keep[outputs[~rejected]] = False
+        self.subjects = lookup[self.subjects[keep]]
+        self.parities = self.parities[keep]
+        self.arities = self.arities[keep]
+        self.objects = np.where(self.objects[keep] >= 0, lookup[self.objects[keep]], -1)
+        self.bound &= lookup == np.arange(len(self.names))
+        self.renaming = lookup[self.renaming]
+        counters['fusions'] += int((~rejected).sum())
+        return int((~rejected).sum())
+
+
+
+def reduce_flat(agent: CanonicalAgent) -> CanonicalAgent:
+    computation = [agent]
+    while True:
+        store = SoloArray.from_agent(computation[-1])
+        while store.fuse():
+            pass
+        computation.append(store.to_agent(computation[-1]).reduce_parallel())
+        if any(map(computation[-1].__eq__, computation[:-1])):
+            return computation[-1]
@@ -0,0 +1,116 @@
+#! /usr/bin/env python3
+
+from __future__ import annotations
+import tracemalloc
+from argparse import ArgumentParser
+from random import Random
+from statistics import quantiles
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, NamedTuple
+
+from multiset import FrozenMultiset as multiset
+
+from calculus import CanonicalAgent, Solo
+from repl import reduce
+from strategies import CheapestFirst, FuseFirst, MaximalParallel, RoundRobin
+
+try:
+    from arrays import reduce_flat
+except ImportError:
+    reduce_flat = None
+
+
+Engine = Callable[[CanonicalAgent], CanonicalAgent]
+
+engines: Dict[str, Engine] = {
+    'first': reduce,
+    'cheapest': lambda agent: reduce(agent, strategy=CheapestFirst()),
+    'fuse': lambda agent: reduce(agent, strategy=FuseFirst()),
+    'round-robin': lambda agent: reduce(agent, strategy=RoundRobin()),
+    'parallel': lambda agent: reduce(agent, strategy=MaximalParallel()),
+}
+if reduce_flat is not None:
+    engines['flat'] = reduce_flat
+
+
+def generate(count: int, pairs: int = 4, names: int = 6, seed: int = 0) -> Iterator[CanonicalAgent]:
+    # NOTE: every subject has one input and one output and every object is bound,
+    #       so no fusion can block another and all engines must agree up to alpha
+    random = Random(seed)
+    bound = ['x%d' % i for i in range(names)]
+    for _ in range(count):
+        solos = []
+        for i in range(pairs):
+            arity = random.randint(1, 3)
+            solos.append(Solo('c%d' % i, tuple(random.choices(bound, k=arity)), True))
+            solos.append(Solo('c%d' % i, tuple(random.choices(bound, k=arity)), False))
+        solos.append(Solo('p', tuple(random.sample(bound, 2)), True))
+        used = frozenset(name for solo in solos for name in solo.objects)
+        yield CanonicalAgent((used, multiset(solos), frozenset()))
+
+
+
+class Report(NamedTuple):
+    engine: str
+    agents: int
+    throughput: float
+    p50: float
+    p95: float
+    p99: float
+    peak: int
+    mismatches: int
+
+
+def run(agents: List[CanonicalAgent], names: List[str] = None,
+        reference: str = 'first') -> List[Report]:
+    names = names if names else list(engines)
+    expected = [engines[reference](agent) for agent in agents]
+    reports = []
+    for name in names:
+        engine = engines[name]
+        latencies, mismatches = [], 0
+        for agent, normal_form in zip(agents, expected):
+            started = perf_counter()
+            result = engine(agent)
+            latencies.append(perf_counter() - started)
+            if result.alpha_eq(normal_form) is None:
+                mismatches += 1
+        # NOTE: tracing slows allocation down, so memory is measured in a separate pass
+        tracemalloc.start()
+        for agent in agents:
+            engine(agent)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        percentiles = quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 \
+            else latencies * 99
+        reports.append(Report(name, len(agents), len(agents) / sum(latencies),
+                              percentiles[49], percentiles[94], percentiles[98],
+                              peak, mismatches))
+    return reports
+
+
+def table(reports: List[Report]) -> str:
+    rows = ['%-12s %8s %12s %10s %10s %10s %10s %10s'
+            % ('engine', 'agents', 'agents/s', 'p50 ms', 'p95 ms', 'p99 ms', 'peak KiB', 'mismatch')]
+    for report in reports:
+        rows.append('%-12s %8d %12.1f %10.3f %10.3f %10.3f %10.1f %10d'
+                    % (report.engine, report.agents, report.throughput,
+                       report.p50 * 1e3, report.p95 * 1e3, report.p99 * 1e3,
+                       report.peak / 1024, report.mismatches))
+    return '\n'.join(rows)
+
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Compare reduction engines on generated agents.')
+    parser.add_argument('--agents', type=int, default=200)
+    parser.add_argument('--pairs', type=int, default=4)
+    parser.add_argument('--names', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--engines', nargs='*', choices=list(engines), default=None)
+    args = parser.parse_args()
+    agents = list(generate(args.agents, args.pairs, args.names, args.seed))
+    reports = run(agents, args.engines)
+    print(table(reports))
+    if any(report.mismatches for report in reports):
+        raise SystemExit(1)
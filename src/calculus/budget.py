@@ -0,0 +1,123 @@
+#! /usr/bin/env python3
+
+from __future__ import annotations
+from time import monotonic
+from typing import List, Tuple, FrozenSet as Set
+
+from multiset import FrozenMultiset as multiset
+
+from calculus import CanonicalAgent, Solo
+
+
+def shape(solo: Solo, bound: Set[str]) -> tuple:
+    return (None if solo.subject in bound else solo.subject,
+            solo.parity,
+            tuple(None if name in bound else name for name in solo.objects))
+
+
+def shapes(agent: CanonicalAgent) -> Tuple[multiset, multiset]:
+    solos = multiset(shape(solo, agent.scope) for solo in agent.solos)
+    replicators = multiset(multiset(shape(solo, agent.scope | replicator.scope)
+                                    for solo in replicator.solos)
+                           for replicator in agent.replicators)
+    return solos, replicators
+
+
+
+class ReductionStopped(Exception):
+
+    # NOTE: args must match the constructor for the exception to unpickle across processes
+    def __init__(self, agent: CanonicalAgent, steps: int, *args) -> None:
+        super().__init__(agent, steps, *args)
+        self.agent = agent
+        self.steps = steps
+
+
+
+class BudgetExceeded(ReductionStopped):
+
+    def __init__(self, agent: CanonicalAgent, steps: int, budget: str) -> None:
+        super().__init__(agent, steps, budget)
+        self.budget = budget
+
+
+    def __str__(self) -> str:
+        return '%s budget exceeded after %d steps' % (self.budget, self.steps)
+
+
+
+class Diverged(ReductionStopped):
+
+    def __init__(self, agent: CanonicalAgent, steps: int, base: CanonicalAgent,
+                 residue: CanonicalAgent, period: int) -> None:
+        super().__init__(agent, steps, base, residue, period)
+        self.base = base
+        self.residue = residue
+        self.period = period
+
+
+    def __str__(self) -> str:
+        return '%s | %s^n' % (self.base, self.residue)
+
+
+
+class Budget:
+
+    def __init__(self, steps: int = None, size: int = None, time: float = None,
+                 patience: int = None, period: int = 4) -> None:
+        self.steps = steps
+        self.size = size
+        self.time = time
+        self.patience = patience
+        self.period = period
+        self.start()
+
+
+    def start(self) -> None:
+        self.started = monotonic()
+        self.spent = 0
+        self.shapes: List[Tuple[multiset, multiset]] = []
+
+
+    def check(self, computation: List[CanonicalAgent]) -> None:
+        steps = len(computation) - 1
+        agent = computation[-1]
+        self.spent = steps
+        if self.steps is not None and steps > self.steps:
+            raise BudgetExceeded(agent, steps, 'step')
+        if self.size is not None and agent.size > self.size:
+            raise BudgetExceeded(agent, steps, 'size')
+        if self.time is not None and monotonic() - self.started > self.time:
+            raise BudgetExceeded(agent, steps, 'time')
+        if self.patience is not None:
+            self.shapes += [shapes(agent) for agent in computation[len(self.shapes):]]
+            for period in range(1, self.period + 1):
+                self.check_pumping(computation, period)
+
+
+    def check_pumping(self, computation: List[CanonicalAgent], period: int) -> None:
+        # NOTE: states are compared by shape, blind to the choice of bound names,
+        #       so the same residue reappearing under fresh names is recognised
+        if len(self.shapes) <= self.patience * period:
+            return
+        residues = []
+        for i in range(self.patience):
+            after, after_reps = self.shapes[-1 - i * period]
+            before, before_reps = self.shapes[-1 - (i + 1) * period]
+            if after_reps != before_reps or not before <= after or before == after:
+                return
+            residues.append(after - before)
+        if any(residue != residues[0] for residue in residues):
+            return
+        base = computation[-1 - self.patience * period]
+        agent = computation[-1]
+        residue = []
+        remaining = dict(residues[0].items())
+        for solo in agent.solos:
+            if remaining.get(shape(solo, agent.scope), 0):
+                remaining[shape(solo, agent.scope)] -= 1
+                residue.append(solo)
+        names = set(name for solo in residue for name in solo.names)
+        raise Diverged(agent, len(computation) - 1, base,
+                       CanonicalAgent((agent.scope & names, multiset(residue), frozenset())),
+                       period)
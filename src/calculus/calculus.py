@@ -1,27 +1,38 @@
 #! /usr/bin/env python3
 
 from __future__ import annotations
+from collections import Counter
 from functools import reduce
+from io import StringIO
 from itertools import count, permutations
 from operator import eq
 from string import digits
-from typing import Iterator, Iterable, List, Tuple, TypeVar, Union, FrozenSet as Set
+from typing import Dict, Iterator, TextIO, Iterable, List, NamedTuple, Tuple, TypeVar, Union, FrozenSet as Set
 
 from multiset import FrozenMultiset as multiset
 
 from graph import graph
-from hashdict import hashdict
+from interactions import interactions
+from pmap import pmap
 
 mutableset, set = set, frozenset
 
+# NOTE: engine counters, cheap enough to be always on and reset by the caller
+counters: Counter = Counter()
+
 
 def fresh_name(working_set: Set[str], name_hints: List[str] = ['u']) -> List[str]:
     names: List[str] = []
+    taken: mutableset = mutableset()
+    next_index: dict = {}
     for name_hint in name_hints:
         name_hint = name_hint.rstrip(digits)
-        for name in (str(name_hint + str(i)) for i in count()):
-            if name not in working_set | set(names):
+        for i in count(next_index.get(name_hint, 0)):
+            name = str(name_hint + str(i))
+            if name not in working_set and name not in taken:
                 names += [name]
+                taken.add(name)
+                next_index[name_hint] = i + 1
                 break
     return names
 
@@ -30,11 +41,61 @@ def combinations(a: set, b: set) -> set:
     return set({set(zip(x, b)) for x in permutations(a, len(b))})
 
 
+
+class Truncated(Exception):
+    pass
+
+
+
+class truncated:
+    """
+    text stream wrapper that passes through at most limit characters,
+    then marks the elision and stops the writer by raising Truncated
+    """
+
+    def __init__(self, out: TextIO, limit: int, ellipsis: str = '...') -> None:
+        self.out = out
+        self.remaining = limit
+        self.ellipsis = ellipsis
+
+    def write(self, text: str) -> None:
+        if len(text) > self.remaining:
+            self.out.write(text[:self.remaining])
+            self.out.write(self.ellipsis)
+            raise Truncated()
+        self.remaining -= len(text)
+        self.out.write(text)
+
+
+def write_joined(out: TextIO, agents: Iterable[Agent], separator: str,
+                 depth: int = None) -> None:
+    for i, agent in enumerate(agents):
+        if i:
+            out.write(separator)
+        agent.write(out, depth)
+
+
 class Agent:
 
     def __str__(self) -> str:
+        out = StringIO()
+        self.write(out)
+        return out.getvalue()
+
+
+    def write(self, out: TextIO, depth: int = None) -> None:
         raise NotImplementedError
 
+
+    def format(self, limit: int = None, depth: int = None) -> str:
+        # NOTE: depth elides replicator bodies nested deeper than it as !...
+        out = StringIO()
+        try:
+            self.write(out if limit is None else truncated(out, limit), depth)
+        except Truncated:
+            pass
+        return out.getvalue()
+
     
     def equals(self, other) -> bool:
         raise NotImplementedError
@@ -71,8 +132,11 @@ class Scope(Agent):
         self.scope = scope
 
 
-    def __str__(self) -> str:
-        return '(%s)%s' % (' '.join(self.scope), str(self.child))
+    def write(self, out: TextIO, depth: int = None) -> None:
+        out.write('(')
+        out.write(' '.join(self.scope))
+        out.write(')')
+        self.child.write(out, depth)
 
 
     def flatten(self) -> Scope:
@@ -104,8 +168,10 @@ class Composition(Agent):
         self.children = children
 
 
-    def __str__(self) -> str:
-        return '(%s)' % (' | '.join(map(str, self.children)),)
+    def write(self, out: TextIO, depth: int = None) -> None:
+        out.write('(')
+        write_joined(out, self.children, ' | ', depth)
+        out.write(')')
 
 
     def construct_alpha(self, agent: Agent) -> Alpha:
@@ -147,8 +213,12 @@ class Replication(Agent):
         self.child = child
 
 
-    def __str__(self) -> str:
-        return '!%s' % (str(self.child),)
+    def write(self, out: TextIO, depth: int = None) -> None:
+        out.write('!')
+        if depth == 0:
+            out.write('...')
+        else:
+            self.child.write(out, None if depth is None else depth - 1)
 
 
     def flatten(self) -> Agent:
@@ -191,9 +261,11 @@ class Solo(Agent):
         self.parity = parity
 
 
-    def __str__(self) -> str:
-        subject = self.subject if self.parity else '\u0305' + '\u0305'.join(self.subject)
-        return ' '.join([subject] + list(self.objects))
+    def write(self, out: TextIO, depth: int = None) -> None:
+        out.write(self.subject if self.parity else '\u0305' + '\u0305'.join(self.subject))
+        for name in self.objects:
+            out.write(' ')
+            out.write(name)
 
     
     def __eq__(self, other: object) -> bool:
@@ -204,7 +276,8 @@ class Solo(Agent):
 
 
     def __lt__(self, other: Solo) -> bool:
-        return str(self) < str(other)
+        return (self.subject, self.parity, tuple(self.objects)) \
+             < (other.subject, other.parity, tuple(other.objects))
     
 
     def __hash__(self) -> int:
@@ -220,6 +293,16 @@ class Solo(Agent):
         return len(self.objects)
 
 
+    @property
+    def port(self) -> Tuple[str, int, bool]:
+        return (self.subject, self.arity, self.parity)
+
+
+    @property
+    def coport(self) -> Tuple[str, int, bool]:
+        return (self.subject, self.arity, not self.parity)
+
+
     @property
     def names(self) -> Set[str]:
         return set({self.subject} | {*self.objects})
@@ -243,7 +326,9 @@ class CanonicalAgent(Agent):
         self.scope: Set[str] = None
         self.solos: multiset = None
         self.replicators: Set[CanonicalAgent] = None
+        self._interactions: interactions = None
         if isinstance(agent, Agent):
+            counters['canonicalisations'] += 1
             base = CanonicalAgent((set(), multiset(), set()))
             base |= agent
             self.scope, self.solos, self.replicators = base
@@ -267,12 +352,14 @@ class CanonicalAgent(Agent):
             for rep_comb in combinations(self.replicators, other.replicators):
                 rep_alphas = [r1.alpha_eq(r2, scope=self.scope)
                               for r1, r2 in rep_comb]
-                if not all(rep_alphas) \
-                or any([any([a1[k] != a2[k] for k in a1.keys() & a2.keys()])
-                        for alpha_comb in combinations(rep_alphas, rep_alphas)
-                        for a1, a2 in alpha_comb]):
+                if not all(rep_alphas):
+                    continue
+                # NOTE: merge is None as soon as two replicator alphas disagree on a name
+                ext = reduce(lambda a, b: a and a.merge(b), rep_alphas, Alpha())
+                if ext is None:
                     continue
-                alpha = reduce(lambda a, ext: Alpha(a, **ext), rep_alphas, alpha)
+                if rep_alphas:
+                    alpha = Alpha(alpha.update(ext))
                 if alpha(self) == other:
                     return alpha
             if alpha(self) == other:
@@ -284,16 +371,44 @@ class CanonicalAgent(Agent):
         return hash(tuple(iter(self)))
 
 
+    def __reduce__(self) -> tuple:
+        from codec import dumps, loads
+        return (loads, (dumps(self),))
+
+
+    @classmethod
+    def compose(cls, agents: Iterable[CanonicalAgent]) -> CanonicalAgent:
+        agents = list(agents)
+        taken = mutableset(reduce(set.union, map(lambda x: x.free_names, agents), set()))
+        scope, solos, replicators = mutableset(), [], mutableset()
+        for agent in agents:
+            collisions = agent.scope & taken
+            if collisions:
+                sorted_collisions = list(sorted(collisions))
+                fresh_names = fresh_name(taken | agent.names, sorted_collisions)
+                agent = Alpha(zip(sorted_collisions, fresh_names))(agent)
+            taken |= agent.names
+            scope |= agent.scope
+            solos += agent.solos
+            replicators |= agent.replicators
+        return cls((set(scope), multiset(solos), set(replicators)))
+
+
     def __iter__(self) -> Iterable:
         yield self.scope
         yield self.solos
         yield self.replicators
 
 
-    def __str__(self) -> str:
-        return '(%s)(%s)' % (' '.join(self.scope),
-                             ' | '.join(list(map(str, self.solos)) +
-                                        ['!%s' % r for r in self.replicators]))
+    def write(self, out: TextIO, depth: int = None) -> None:
+        out.write('(')
+        out.write(' '.join(self.scope))
+        out.write(')(')
+        write_joined(out, self.solos, ' | ')
+        if self.solos and self.replicators:
+            out.write(' | ')
+        write_joined(out, map(Replication, self.replicators), ' | ', depth)
+        out.write(')')
 
     
     def __repr__(self) -> str:
@@ -308,6 +423,7 @@ class CanonicalAgent(Agent):
 
     def construct_sigma(self, input: Solo, output: Solo,
                         bound_names: Set[str] = set()) -> Tuple[Sigma, Set[str]]:
+        counters['redexes tried'] += 1
         if any([input.subject != output.subject,
                 input.arity != output.arity,
                 input.parity == output.parity,
@@ -315,11 +431,13 @@ class CanonicalAgent(Agent):
             # NOTE: (u x | (u)^u y) should not reduce
             return None, None
         g = graph()
-        sigma = Sigma()
+        sigma: Dict[str, str] = {}
         fresh_names: Set[str] = set()
         for i_obj, o_obj in zip(input.objects, output.objects):
             g.insert_edge(i_obj, o_obj)
         for partition in g.partitions:
+            if len(partition) == 1:
+                continue
             intersect = partition - (self.scope | bound_names)
             if len(intersect) == 0:
                 free_name, *_ = fresh_name(self.names | fresh_names)
@@ -330,7 +448,38 @@ class CanonicalAgent(Agent):
                 return None, None
             for name in partition - {free_name}:
                 sigma[name] = free_name
-        return sigma, fresh_names
+        return Sigma(sigma), fresh_names
+
+
+    def substitute(self, sigma: Dict[str, str]) -> CanonicalAgent:
+        # NOTE: renames free names directly, without going back through flatten
+        sigma = {name: fused for name, fused in sigma.items() if name not in self.scope}
+        if not sigma:
+            return self
+        captured = self.scope & set(sigma.values())
+        if captured:
+            sorted_captured = list(sorted(captured))
+            sigma.update(zip(sorted_captured,
+                             fresh_name(self.names | set(sigma.values()), sorted_captured)))
+        return type(self)((set(sigma.get(name, name) for name in self.scope),
+                           multiset(type(solo)(sigma.get(solo.subject, solo.subject),
+                                               tuple(sigma.get(name, name) for name in solo.objects),
+                                               solo.parity)
+                                    for solo in self.solos),
+                           set(replicator.substitute(sigma) for replicator in self.replicators)))
+
+
+    def instantiate(self, replicator: CanonicalAgent) -> CanonicalAgent:
+        counters['replicator firings'] += 1
+        collisions = replicator.scope & self.names
+        if collisions:
+            replicator = self.construct_alpha(collisions)(replicator)
+        reduction = type(self)((self.scope | replicator.scope,
+                                self.solos + replicator.solos,
+                                self.replicators))
+        if self._interactions is not None:
+            reduction._interactions = self._interactions.copy().insert(*replicator.solos)
+        return reduction
 
 
     def __or__(self, agent: Agent) -> CanonicalAgent:
@@ -369,9 +518,9 @@ class CanonicalAgent(Agent):
             if collisions:
                 return self.construct_alpha(collisions)(self) | agent
             else:
-                return type(self)(self.scope,
-                                  self.solos + {agent},
-                                  self.replicators)
+                return type(self)((self.scope,
+                                   self.solos + {agent},
+                                   self.replicators))
 
         else:
             assert isinstance(agent, type(self))
@@ -382,36 +531,132 @@ class CanonicalAgent(Agent):
         return type(self)(tuple(iter(self)))
 
 
-    def reduce(self) -> CanonicalAgent:
-        self.scope &= self.solo_names | self.replicator_names
+    def redexes(self) -> Iterator[Redex]:
+        live_solos = self.live_solos.distinct_elements()
+        solo_ports: dict = {}
+        for solo in live_solos:
+            solo_ports.setdefault(solo.port, []).append(solo)
+        replicator_ports: dict = {}
+        for replicator in self.live_replicators:
+            for solo in replicator.free_solos:
+                replicator_ports.setdefault(solo.port, []).append((replicator, solo))
 
         for input, output in ((input, output)
-                              for input in self.solos
-                              for output in self.solos - {input}):
+                              for input in live_solos
+                              for output in solo_ports.get(input.coport, [])):
             sigma, rescope = self.construct_sigma(input, output)
             if sigma:
-                scope, solos, replicators = self
-                solos -= {input, output}
-                return sigma(CanonicalAgent((scope | rescope, solos, replicators)))
+                yield Redex(input, output, None, None, sigma, rescope)
 
         for input, replicator, output in ((input, replicator, output)
-                              for input in self.solos
-                              for replicator in self.replicators
-                              for output in replicator.solos):
-            sigma, _ = self.construct_sigma(input, output, replicator.scope)
+                              for input in live_solos
+                              for replicator, output in replicator_ports.get(input.coport, [])):
+            sigma, rescope = self.construct_sigma(input, output, replicator.scope)
             if sigma:
-                return self | replicator
+                yield Redex(input, output, None, replicator, sigma, rescope)
 
         for input, ireplicator, output, oreplicator in ((input, ireplicator, output, oreplicator)
-                              for ireplicator in self.replicators
-                              for input in ireplicator.solos
-                              for oreplicator in self.replicators
-                              for output in oreplicator.solos):
-            sigma, _ = self.construct_sigma(input, output, ireplicator.scope | oreplicator.scope)
+                              for ports in replicator_ports.values()
+                              for ireplicator, input in ports
+                              for oreplicator, output in replicator_ports.get(input.coport, [])):
+            sigma, rescope = self.construct_sigma(input, output, ireplicator.scope | oreplicator.scope)
             if sigma:
-                return self | ireplicator | oreplicator
+                yield Redex(input, output, ireplicator, oreplicator, sigma, rescope)
+
+
+    def fire(self, redex: Redex) -> CanonicalAgent:
+        if redex.oreplicator is None:
+            counters['fusions'] += 1
+            scope, solos, replicators = self
+            solos -= {redex.input, redex.output}
+            reduction = redex.sigma(CanonicalAgent((scope | redex.rescope, solos, replicators)))
+            if len(reduction.replicators) == len(replicators):
+                ports = self.ports.copy().remove(redex.input, redex.output)
+                reduction._interactions = ports.rename(redex.sigma)
+            return reduction
+        elif redex.ireplicator is None:
+            return self.instantiate(redex.oreplicator)
+        else:
+            return self.instantiate(redex.ireplicator).instantiate(redex.oreplicator)
+
+
+    def reduce(self, strategy=None) -> CanonicalAgent:
+        self.scope &= self.solo_names | self.replicator_names
+        if strategy is None:
+            redex = next(self.redexes(), None)
+        else:
+            redex = strategy.select(self, self.redexes())
+        return self if redex is None else self.fire(redex)
+
 
-        return self
+    def reduce_parallel(self) -> CanonicalAgent:
+        self.scope &= self.solo_names | self.replicator_names
+
+        parent: dict = {}
+        free: dict = {}
+
+        def find(name: str) -> str:
+            while parent.setdefault(name, name) != name:
+                parent[name] = parent[parent[name]]
+                name = parent[name]
+            return name
+
+        def free_name_of(root: str) -> str:
+            return free.get(root, None if root in self.scope else root)
+
+        def fuse(input: Solo, output: Solo) -> bool:
+            g = graph()
+            for i_obj, o_obj in zip(input.objects, output.objects):
+                g.insert_edge(find(i_obj), find(o_obj))
+            partitions = [partition for partition in g.partitions if len(partition) > 1]
+            free_names = [set(map(free_name_of, partition)) - {None} for partition in partitions]
+            if not partitions or any(len(names) > 1 for names in free_names):
+                # NOTE: a redex made trivial by an earlier fusion would not fire sequentially
+                return False
+            for partition, names in zip(partitions, free_names):
+                root, *rest = partition
+                for name in rest:
+                    parent[name] = root
+                if names:
+                    free[root], *_ = names
+            return True
+
+        available = dict(self.live_solos.items())
+        solo_ports: dict = {}
+        for solo in available.keys():
+            solo_ports.setdefault(solo.port, []).append(solo)
+        consumed: List[Solo] = []
+        for input in list(available.keys()):
+            for output in solo_ports.get(input.coport, []):
+                while available[input] and available[output] and fuse(input, output):
+                    available[input] -= 1
+                    available[output] -= 1
+                    consumed += [input, output]
+        if not consumed:
+            return self.reduce()
+
+        partitions: dict = {}
+        for name in parent.keys():
+            partitions.setdefault(find(name), []).append(name)
+        partitions = {root: partition for root, partition in partitions.items()
+                      if len(partition) > 1}
+        bound_roots = [root for root in partitions.keys() if free_name_of(root) is None]
+        rescope = dict(zip(bound_roots, fresh_name(self.names, ['u'] * len(bound_roots))))
+        fusions: Dict[str, str] = {}
+        for root, partition in partitions.items():
+            free_name = free_name_of(root) or rescope[root]
+            for name in partition:
+                if name != free_name:
+                    fusions[name] = free_name
+        sigma = Sigma(fusions)
+
+        counters['fusions'] += len(consumed) // 2
+        scope, solos, replicators = self
+        solos -= multiset(consumed)
+        reduction = sigma(CanonicalAgent((scope | set(rescope.values()), solos, replicators)))
+        if len(reduction.replicators) == len(replicators):
+            reduction._interactions = self.ports.copy().remove(*consumed).rename(sigma)
+        return reduction
 
 
     @property
@@ -424,14 +669,19 @@ class CanonicalAgent(Agent):
         return self.scope | self.solo_names | self.replicator_names
 
 
+    @property
+    def size(self) -> int:
+        return len(self.solos) + sum(map(lambda rep: rep.size, self.replicators))
+
+
     @property
     def solo_names(self) -> Set[str]:
-        return set(reduce(lambda red, solo: red | solo.names, self.solos, set())) 
+        return set(name for solo in self.solos.distinct_elements() for name in solo.names)
 
 
     @property
     def replicator_names(self) -> Set[str]:
-        return set(reduce(lambda red, rep: red | rep.names, self.replicators, set()))
+        return set(name for rep in self.replicators for name in rep.names)
 
 
     @property
@@ -439,9 +689,112 @@ class CanonicalAgent(Agent):
         return self.scope
 
 
+    @property
+    def components(self) -> List[CanonicalAgent]:
+        parent: dict = {}
+
+        def find(name: str) -> str:
+            while parent.setdefault(name, name) != name:
+                parent[name] = parent[parent[name]]
+                name = parent[name]
+            return name
+
+        def union(names: Iterable[str]) -> str:
+            root, *rest = map(find, names)
+            for name in rest:
+                parent[name] = root
+            return root
+
+        solos: dict = {}
+        replicators: dict = {}
+        closed: List[CanonicalAgent] = []
+        for solo in self.solos.distinct_elements():
+            union(solo.names)
+        for replicator in self.replicators:
+            if replicator.free_names:
+                union(replicator.free_names)
+            else:
+                closed.append(type(self)((set(), multiset(), set({replicator}))))
+        for solo, multiplicity in self.solos.items():
+            solos.setdefault(find(solo.subject), []).extend([solo] * multiplicity)
+        for replicator in self.replicators:
+            if replicator.free_names:
+                root = find(next(iter(replicator.free_names)))
+                replicators.setdefault(root, []).append(replicator)
+        scopes: dict = {}
+        for name in self.scope & parent.keys():
+            scopes.setdefault(find(name), []).append(name)
+        return [type(self)((set(scopes.get(root, [])),
+                            multiset(solos.get(root, [])),
+                            set(replicators.get(root, []))))
+                for root in solos.keys() | replicators.keys()] + closed
+
+
+    @property
+    def free_solos(self) -> multiset:
+        return multiset(filter(lambda solo: solo.subject not in self.scope, self.solos))
+
+
+    @property
+    def ports(self) -> interactions:
+        if self._interactions is None:
+            self._interactions = interactions().insert(
+                *self.solos,
+                *(solo for replicator in self.replicators for solo in replicator.free_solos))
+        return self._interactions
+
+
+    @property
+    def live_solos(self) -> multiset:
+        return multiset(filter(self.ports.complements, self.solos))
+
+
+    @property
+    def live_replicators(self) -> Set[CanonicalAgent]:
+        return set(filter(lambda rep: any(map(self.ports.complements, rep.free_solos)),
+                          self.replicators))
+
+
+    @property
+    def inert_replicators(self) -> Set[CanonicalAgent]:
+        return self.replicators - self.live_replicators
+
+
+    @property
+    def dead_names(self) -> Set[str]:
+        live_names = reduce(lambda red, agent: red | agent.names,
+                            [*self.live_solos, *self.live_replicators], set())
+        return self.scope - live_names
+
+
+
+class Redex(NamedTuple):
+    input: Solo
+    output: Solo
+    ireplicator: CanonicalAgent
+    oreplicator: CanonicalAgent
+    sigma: Sigma
+    rescope: Set[str]
+
+
+    @property
+    def subject(self) -> str:
+        return self.input.subject
+
+
+    @property
+    def growth(self) -> int:
+        if self.oreplicator is None:
+            return -2
+        elif self.ireplicator is None:
+            return len(self.oreplicator.solos)
+        else:
+            return len(self.ireplicator.solos) + len(self.oreplicator.solos)
+
+
 
 T = TypeVar('T', Solo, Scope, Composition, Replication, CanonicalAgent, Agent, str)
-class Match(dict):
+class Match(pmap):
 
     def __init__(self, *args, in_scope: multiset = multiset(),
                  fuse: bool = False, **kwargs) -> None:
@@ -478,7 +831,7 @@ class Match(dict):
 
 
 
-class Alpha(Match, hashdict):
+class Alpha(Match):
 
     def __init__(self, *args, fuse=False, **kwargs) -> None:
         super().__init__(*args, fuse=fuse, **kwargs)
@@ -0,0 +1,93 @@
+#! /usr/bin/env python3
+
+# NOTE: only the standard library is imported at module level, the calculus
+#       (and with it regex and multiset) is imported once arguments are parsed
+
+import json
+import sys
+from argparse import ArgumentParser, ArgumentTypeError, FileType, Namespace
+from typing import Iterator, List, TextIO
+
+STARTUP_BUDGET = 0.5
+
+
+def positive(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise ArgumentTypeError('must be at least 1: %s' % value)
+    return number
+
+
+def positive_float(value: str) -> float:
+    number = float(value)
+    if number <= 0:
+        raise ArgumentTypeError('must be greater than 0: %s' % value)
+    return number
+
+
+def parse_args(argv: List[str] = None) -> Namespace:
+    parser = ArgumentParser(description='Reduce solo calculus agents to normal form, '
+                                        'one agent per line.')
+    parser.add_argument('files', nargs='*', type=FileType('r'), default=[sys.stdin],
+                        help='files of agents, read from stdin if none are given')
+    parser.add_argument('-j', '--jobs', type=positive, default=1,
+                        help='number of worker processes')
+    parser.add_argument('--max-steps', type=positive, default=None,
+                        help='step budget for each agent')
+    parser.add_argument('--timeout', type=positive_float, default=None,
+                        help='time budget in seconds for each agent')
+    parser.add_argument('--strategy', default='first',
+                        help='reduction strategy (first, cheapest, fuse, round-robin, random, parallel)')
+    parser.add_argument('--stats', action='store_true',
+                        help='report steps and time taken for each agent')
+    parser.add_argument('--format', choices=['text', 'json'], default='text',
+                        help='output format, json writes one object per line')
+    return parser.parse_args(argv)
+
+
+def read_agents(files: List[TextIO]) -> Iterator[str]:
+    for file in files:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+
+
+def main(argv: List[str] = None, out: TextIO = sys.stdout) -> int:
+    args = parse_args(argv)
+
+    from budget import Budget
+    from repl import build_agent, reduce_many
+    from strategies import strategies
+
+    if args.strategy not in strategies:
+        print('unknown strategy: %s' % args.strategy, file=sys.stderr)
+        return 2
+    texts = list(read_agents(args.files))
+    try:
+        agents = [build_agent(text) for text in texts]
+    except Exception as error:
+        print(error, file=sys.stderr)
+        return 1
+
+    reductions = reduce_many(agents, jobs=args.jobs, chunksize=max(1, len(agents) // (4 * args.jobs)),
+                             strategy=strategies[args.strategy](),
+                             budget=Budget(steps=args.max_steps), timeout=args.timeout)
+    for text, reduction in zip(texts, reductions):
+        if args.format == 'json':
+            record = {'agent': text, 'normal_form': str(reduction.agent)}
+            if args.stats:
+                record.update(steps=reduction.steps, time=reduction.time, stopped=reduction.stopped)
+            print(json.dumps(record), file=out)
+        elif args.stats:
+            print('%s\t# %d steps, %.6fs%s' % (reduction.agent, reduction.steps, reduction.time,
+                                              ', ' + reduction.stopped if reduction.stopped else ''),
+                  file=out)
+        else:
+            print(reduction.agent, file=out)
+    return 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
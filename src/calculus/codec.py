@@ -0,0 +1,105 @@
+#! /usr/bin/env python3
+
+from __future__ import annotations
+from array import array
+from os import replace
+from struct import Struct
+from sys import byteorder
+from typing import BinaryIO, Dict, List, Tuple
+
+from multiset import FrozenMultiset as multiset
+
+from calculus import CanonicalAgent, Solo
+
+MAGIC = b'SOLO'
+VERSION = 1
+
+# magic, version, byte length of the name table, number of integer records
+_header = Struct('<4sBII')
+_record = Struct('<I')
+
+
+def encode(agent: CanonicalAgent, index: Dict[str, int], ints: array) -> None:
+    def intern(name: str) -> int:
+        return index.setdefault(name, len(index))
+
+    ints.append(len(agent.scope))
+    ints.extend(map(intern, agent.scope))
+    ints.append(len(agent.solos))
+    for solo in agent.solos:
+        ints.extend((intern(solo.subject), solo.parity, solo.arity))
+        ints.extend(map(intern, solo.objects))
+    ints.append(len(agent.replicators))
+    for replicator in agent.replicators:
+        encode(replicator, index, ints)
+
+
+def decode(names: List[str], ints: array, i: int = 0) -> Tuple[CanonicalAgent, int]:
+    n, i = ints[i], i + 1
+    scope, i = frozenset(names[j] for j in ints[i:i + n]), i + n
+    n, i = ints[i], i + 1
+    solos = []
+    for _ in range(n):
+        subject, parity, arity = ints[i:i + 3]
+        solos.append(Solo(names[subject], tuple(names[j] for j in ints[i + 3:i + 3 + arity]),
+                          bool(parity)))
+        i += 3 + arity
+    n, i = ints[i], i + 1
+    replicators = []
+    for _ in range(n):
+        replicator, i = decode(names, ints, i)
+        replicators.append(replicator)
+    return CanonicalAgent((scope, multiset(solos), frozenset(replicators))), i
+
+
+def dumps(agent: CanonicalAgent) -> bytes:
+    index: Dict[str, int] = {}
+    ints = array('I')
+    encode(agent, index, ints)
+    # NOTE: names are parsed from [a-z0-9]+ so a NUL separator is never ambiguous
+    table = '\0'.join(index).encode()
+    if byteorder == 'big':
+        ints.byteswap()
+    return _header.pack(MAGIC, VERSION, len(table), len(ints)) + table + ints.tobytes()
+
+
+def loads(data: bytes) -> CanonicalAgent:
+    magic, version, table_size, size = _header.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('Not a serialised agent')
+    if version != VERSION:
+        raise ValueError('Unsupported agent format version: %d' % version)
+    offset = _header.size
+    names = data[offset:offset + table_size].decode().split('\0')
+    ints = array('I')
+    ints.frombytes(data[offset + table_size:offset + table_size + size * ints.itemsize])
+    if byteorder == 'big':
+        ints.byteswap()
+    agent, _ = decode(names, ints)
+    return agent
+
+
+def dump(agent: CanonicalAgent, file: BinaryIO) -> None:
+    data = dumps(agent)
+    file.write(_record.pack(len(data)))
+    file.write(data)
+
+
+def load(file: BinaryIO) -> CanonicalAgent:
+    size, = _record.unpack(file.read(_record.size))
+    return loads(file.read(size))
+
+
+def save_checkpoint(path: str, *agents: CanonicalAgent) -> None:
+    # NOTE: written aside and renamed so that a crash never leaves a torn checkpoint
+    with open(path + '.tmp', 'wb') as file:
+        file.write(_record.pack(len(agents)))
+        for agent in agents:
+            dump(agent, file)
+    replace(path + '.tmp', path)
+
+
+def load_checkpoint(path: str) -> List[CanonicalAgent]:
+    with open(path, 'rb') as file:
+        size, = _record.unpack(file.read(_record.size))
+        return [load(file) for _ in range(size)]
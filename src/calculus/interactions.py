@@ -0,0 +1,40 @@
+#! /usr/bin/env python3
+
+from __future__ import annotations
+from collections import Counter
+from typing import Mapping
+
+
+class interactions(dict):
+
+    def insert(self, *solos) -> interactions:
+        for solo in solos:
+            ports = self.setdefault(solo.subject, Counter())
+            ports[solo.arity, solo.parity] += 1
+        return self
+
+
+    def remove(self, *solos) -> interactions:
+        for solo in solos:
+            ports = self[solo.subject]
+            ports[solo.arity, solo.parity] -= 1
+            if ports[solo.arity, solo.parity] <= 0:
+                del ports[solo.arity, solo.parity]
+            if not ports:
+                del self[solo.subject]
+        return self
+
+
+    def complements(self, solo) -> int:
+        return self.get(solo.subject, {}).get((solo.arity, not solo.parity), 0)
+
+
+    def rename(self, sigma: Mapping[str, str]) -> interactions:
+        for name, fused in sigma.items():
+            if name in self.keys():
+                self.setdefault(fused, Counter()).update(self.pop(name))
+        return self
+
+
+    def copy(self) -> interactions:
+        return type(self)((subject, Counter(ports)) for subject, ports in self.items())
@@ -0,0 +1,182 @@
+#! /usr/bin/env python3
+
+from __future__ import annotations
+from collections.abc import KeysView
+from itertools import chain
+from typing import Any, Hashable, Iterator, Tuple
+
+_missing = object()
+_mask = (1 << 64) - 1
+
+
+def _assoc(node: dict, shift: int, h: int, key: Hashable, value: Any) -> Tuple[dict, Any]:
+    index = (h >> shift) & 31
+    entry = node.get(index)
+    node = dict(node)
+    if entry is None:
+        node[index] = (h, key, value)
+        return node, _missing
+    elif type(entry) is dict:
+        node[index], old = _assoc(entry, shift + 5, h, key, value)
+        return node, old
+    elif type(entry) is list:
+        if entry[0][0] == h:
+            old = next((leaf[2] for leaf in entry if leaf[1] == key), _missing)
+            node[index] = [leaf for leaf in entry if leaf[1] != key] + [(h, key, value)]
+            return node, old
+        child = {(entry[0][0] >> (shift + 5)) & 31: entry}
+    else:
+        eh, ekey, evalue = entry
+        if eh == h and ekey == key:
+            node[index] = (h, key, value)
+            return node, evalue
+        elif eh == h:
+            node[index] = [entry, (h, key, value)]
+            return node, _missing
+        child = {(eh >> (shift + 5)) & 31: entry}
+    node[index], old = _assoc(child, shift + 5, h, key, value)
+    return node, old
+
+
+def _leaves(node: dict) -> Iterator[tuple]:
+    for entry in node.values():
+        if type(entry) is dict:
+            yield from _leaves(entry)
+        elif type(entry) is list:
+            yield from entry
+        else:
+            yield entry
+
+
+
+class pmap:
+    """
+    persistent hashable map, implemented as a hash array mapped trie
+
+    extending shares all but one path of the trie with the original,
+    the hash is kept up to date incrementally as the xor of item hashes
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        if len(args) == 1 and isinstance(args[0], pmap) and not kwargs:
+            self._root, self._size, self._hash = args[0]._root, args[0]._size, args[0]._hash
+            return
+        self._root, self._size, self._hash = {}, 0, 0
+        items = chain(*(arg.items() if hasattr(arg, 'items') else arg for arg in args),
+                      kwargs.items())
+        for key, value in items:
+            self._root, self._size, self._hash = self._extend(key, value)
+
+
+    def _extend(self, key: Hashable, value: Any) -> Tuple[dict, int, int]:
+        root, old = _assoc(self._root, 0, hash(key) & _mask, key, value)
+        if old is _missing:
+            return root, self._size + 1, self._hash ^ hash((key, value))
+        else:
+            return root, self._size, self._hash ^ hash((key, old)) ^ hash((key, value))
+
+
+    def _evolve(self, root: dict, size: int, h: int) -> pmap:
+        ret = object.__new__(type(self))
+        ret.__dict__.update(self.__dict__)
+        ret._root, ret._size, ret._hash = root, size, h
+        return ret
+
+
+    def _find(self, key: Hashable) -> Any:
+        h, node, shift = hash(key) & _mask, self._root, 0
+        while True:
+            entry = node.get((h >> shift) & 31)
+            if entry is None:
+                return _missing
+            elif type(entry) is dict:
+                node, shift = entry, shift + 5
+            elif type(entry) is list:
+                return next((leaf[2] for leaf in entry if leaf[1] == key), _missing)
+            else:
+                return entry[2] if entry[1] == key else _missing
+
+
+    def set(self, key: Hashable, value: Any) -> pmap:
+        return self._evolve(*self._extend(key, value))
+
+
+    def update(self, other: pmap) -> pmap:
+        # values in other take precedence, as with dict.update
+        ret = self
+        for key, value in other.items():
+            ret = ret.set(key, value)
+        return ret
+
+
+    def merge(self, other: pmap) -> pmap:
+        # returns None if self and other disagree on any shared key
+        small, large = (self, other) if len(self) <= len(other) else (other, self)
+        for key, value in small.items():
+            old = large._find(key)
+            if old is _missing:
+                large = large.set(key, value)
+            elif old != value:
+                return None
+        return self._evolve(large._root, large._size, large._hash)
+
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._find(key)
+        return default if value is _missing else value
+
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self._find(key)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._find(key) is not _missing
+
+
+    def __iter__(self) -> Iterator:
+        return (key for _, key, _ in _leaves(self._root))
+
+
+    def __len__(self) -> int:
+        return self._size
+
+
+    def __bool__(self) -> bool:
+        return self._size > 0
+
+
+    def keys(self) -> KeysView:
+        return KeysView(self)
+
+
+    def values(self) -> Iterator:
+        return (value for _, _, value in _leaves(self._root))
+
+
+    def items(self) -> Iterator[Tuple[Hashable, Any]]:
+        return ((key, value) for _, key, value in _leaves(self._root))
+
+
+    def __hash__(self) -> int:
+        return self._hash
+
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, pmap):
+            if len(self) != len(other) or hash(self) != hash(other):
+                return False
+            return all(other._find(key) == value for key, value in self.items())
+        elif isinstance(other, dict):
+            return len(self) == len(other) and all(other.get(key, _missing) == value
+                                                   for key, value in self.items())
+        return NotImplemented
+
+
+    def __repr__(self) -> str:
+        return "{0}({1})".format(self.__class__.__name__,
+            ", ".join("{0}={1}".format(str(key), repr(value))
+                      for key, value in sorted(self.items())))
@@ -1,14 +1,24 @@
 #! /usr/bin/env python3
 
+from copy import copy, deepcopy
+from functools import partial
+from multiprocessing import Pool
+from os.path import exists
+from time import monotonic
+from typing import Iterable, Iterator, NamedTuple, Tuple
+
 import regex as re
 
 from multiset import FrozenMultiset as multiset
 
-from calculus import Solo, Composition, Replication, Scope, Agent, CanonicalAgent
+from budget import Budget, BudgetExceeded, ReductionStopped
+from calculus import Solo, Composition, Replication, Scope, Agent, CanonicalAgent, counters
+from codec import load_checkpoint, save_checkpoint
+from strategies import Strategy, FirstFound
 
 
 _input = re.compile(r'\s?(?P<subject>[a-z0-9]+)(\s(?P<objects>([a-z0-9]+\s?)+))?\s?')
-def build_input(match, names: dict) -> Solo:
+def build_input(match, names: dict, definitions: dict) -> Solo:
     subj_name = match['subject']
     if subj_name not in names.keys():
         names[subj_name] = str(subj_name)
@@ -25,7 +35,7 @@ def build_input(match, names: dict) -> Solo:
 
 
 output = re.compile(r'\s?\^(?P<subject>[a-z0-9]+)(\s(?P<objects>([a-z0-9]+\s?)+))?\s?')
-def build_output(match, names: dict) -> Solo:
+def build_output(match, names: dict, definitions: dict) -> Solo:
     subj_name = match['subject']
     if subj_name not in names.keys():
         names[subj_name] = str(subj_name)
@@ -42,20 +52,20 @@ def build_output(match, names: dict) -> Solo:
 
 
 composition = re.compile(r'\s?\((?<agents>(?<agent>([^|()]|(?<rec>\((?:[^()]++|(?&rec))*\)))+)(\|(?&agents))?)\)\s?')
-def build_composition(match, names: dict) -> Composition:
-    agents = [build_agent(string, names) for string in match.captures('agent')]
+def build_composition(match, names: dict, definitions: dict) -> Composition:
+    agents = [build_agent(string, names, definitions) for string in match.captures('agent')]
     return Composition(multiset(agents))
 
 
 replication = re.compile(r'\s?!(?P<agent>.*)\s?')
-def build_replication(match, names: dict) -> Replication:
-    agent = build_agent(match['agent'], names)
+def build_replication(match, names: dict, definitions: dict) -> Replication:
+    agent = build_agent(match['agent'], names, definitions)
     return Replication(agent)
 
 
 scope = re.compile(r'\s?\((?P<bindings>([a-z0-9]+\s?)+)\)(?P<agent>[^\s].+)\s?')
-def build_scope(match, names: dict) -> Scope:
-    agent = build_agent(match['agent'], names)
+def build_scope(match, names: dict, definitions: dict) -> Scope:
+    agent = build_agent(match['agent'], names, definitions)
     for name in match['bindings'].split():
         if name not in names.keys():
             names[name] = str(name)
@@ -63,43 +73,211 @@ def build_scope(match, names: dict) -> Scope:
     return Scope(agent, bindings)
 
 
-def build_agent(string: str, names: dict=None) -> Agent:
+definition = re.compile(r'\s*let\s+(?P<name>[A-Z][A-Za-z0-9]*)(\((?P<params>[a-z0-9\s]*)\))?\s*='
+                        r'(?P<definition>[^;]+);(?P<agent>.+)', re.DOTALL)
+def build_definition(match, names: dict, definitions: dict) -> CanonicalAgent:
+    # NOTE: the body is parsed and canonicalised once, references only rename it
+    params = tuple((match['params'] or '').split())
+    body = build_agent(match['definition'], {}, definitions)
+    definitions = dict(definitions, **{match['name']: (params, body)})
+    return build_agent(match['agent'], names, definitions)
+
+
+reference = re.compile(r'\s?(?P<name>[A-Z][A-Za-z0-9]*)(\((?P<args>[a-z0-9\s]*)\))?\s?')
+def build_reference(match, names: dict, definitions: dict) -> CanonicalAgent:
+    if match['name'] not in definitions:
+        raise Exception('Undefined agent: %s' % match['name'])
+    params, body = definitions[match['name']]
+    args = tuple((match['args'] or '').split())
+    if len(args) != len(params):
+        raise Exception('%s expects %d names, got %d' % (match['name'], len(params), len(args)))
+    for name in args:
+        names.setdefault(name, name)
+    return body.substitute(dict(zip(params, args)))
+
+
+def build_agent(string: str, names: dict=None, definitions: dict=None) -> Agent:
     if names is None:
         names = dict()
-    for regex, build_func in [(_input, build_input), (output, build_output),
-                               (scope, build_scope), (composition, build_composition),
-                               (replication, build_replication)]:
+    if definitions is None:
+        definitions = dict()
+    for regex, build_func in [(definition, build_definition), (reference, build_reference),
+                              (_input, build_input), (output, build_output),
+                              (scope, build_scope), (composition, build_composition),
+                              (replication, build_replication)]:
         match = regex.fullmatch(string)
         if match:
-            return CanonicalAgent(build_func(match, names))
+            agent = build_func(match, names, definitions)
+            return agent if isinstance(agent, CanonicalAgent) else CanonicalAgent(agent)
     raise Exception('Cannot build agent: %s' % string)
 
 
-def reduce(agent: Agent, verbose=False) -> Agent:
+def reduce(agent: Agent, verbose=False, strategy: Strategy = None,
+           budget: Budget = None, checkpoint: str = None,
+           interval: int = 1000) -> Agent:
+    strategy = strategy if strategy else FirstFound()
+    budget = budget if budget else Budget()
+    budget.start()
     computation = [agent]
+    if checkpoint is not None and exists(checkpoint):
+        # NOTE: only resume a checkpoint that was taken from this very agent
+        origin, resumed = load_checkpoint(checkpoint)
+        if origin == agent:
+            computation = [resumed]
     while True:
-        computation.append(computation[-1].reduce())
+        computation.append(strategy(computation[-1]))
         if verbose:
             print('[verbose]', computation[-2], '->', computation[-1])
         if any(map(computation[-1].__eq__, computation[:-1])):
+            if checkpoint is not None:
+                save_checkpoint(checkpoint, agent, computation[-1])
             return computation[-1]
+        budget.check(computation)
+        if checkpoint is not None and (len(computation) - 1) % interval == 0:
+            save_checkpoint(checkpoint, agent, computation[-1])
 
 
-def repl():
-    agent = Solo('print', tuple('null'), True)
-    print('solo calculus repl (q to quit)...')
-    while True:
-        user_in = input('>> ')
+def reduce_components(agent: CanonicalAgent, jobs: int = 1, strategy: Strategy = None,
+                      budget: Budget = None) -> CanonicalAgent:
+    components = agent.components
+    if jobs > 1 and len(components) > 1:
+        with Pool(min(jobs, len(components))) as pool:
+            normal_forms = pool.map(partial(reduce, strategy=strategy, budget=budget), components)
+    else:
+        normal_forms = [reduce(component, strategy=strategy, budget=budget)
+                        for component in components]
+    return CanonicalAgent.compose(normal_forms)
+
+
+class Reduction(NamedTuple):
+    index: int
+    agent: CanonicalAgent
+    steps: int
+    time: float
+    stopped: str
+
+
+def reduce_task(task: Tuple[int, CanonicalAgent], strategy: Strategy = None,
+                budget: Budget = None, timeout: float = None) -> Reduction:
+    index, agent = task
+    budget = copy(budget) if budget else Budget()
+    if timeout is not None:
+        budget.time = timeout if budget.time is None else min(budget.time, timeout)
+    started = monotonic()
+    try:
+        agent = reduce(agent, strategy=deepcopy(strategy), budget=budget)
+        stopped = None
+    except ReductionStopped as stop:
+        agent, stopped = stop.agent, str(stop)
+    except Exception as error:
+        # NOTE: one failing agent is recorded like a stopped one rather than aborting the batch
+        stopped = '%s: %s' % (type(error).__name__, error)
+    return Reduction(index, agent, budget.spent, monotonic() - started, stopped)
+
+
+def reduce_many(agents: Iterable[CanonicalAgent], jobs: int = 1, chunksize: int = 1,
+                ordered: bool = True, strategy: Strategy = None, budget: Budget = None,
+                timeout: float = None) -> Iterator[Reduction]:
+    # NOTE: the timeout is a per-agent time budget, checked after every step,
+    #       so a divergent agent gives up its worker instead of stalling the batch
+    task = partial(reduce_task, strategy=strategy, budget=budget, timeout=timeout)
+    if jobs > 1:
+        with Pool(jobs) as pool:
+            imap = pool.imap if ordered else pool.imap_unordered
+            yield from imap(task, enumerate(agents), chunksize)
+    else:
+        yield from map(task, enumerate(agents))
+
+
+_help = '''commands:
+    <agent>     parse an agent
+    ->          reduce one step and print the agent
+    -> n        reduce n steps and print a summary
+    ->*         reduce to normal form and print a summary
+    :print      print the agent in full
+    :time       time taken by the last command
+    :stats      engine counters since the last :reset
+    :size       size metrics of the agent
+    :reset      reset the engine counters
+    q           quit'''
+
+
+def summary(agent: CanonicalAgent, steps: int, elapsed: float, stopped: str = None) -> str:
+    return '%d steps, %d solos, %d replicators, %.6fs%s: %s' \
+        % (steps, len(agent.solos), len(agent.replicators), elapsed,
+           ', stopped: ' + stopped if stopped else '', agent.format(limit=80))
+
+
+def metrics(agent: CanonicalAgent) -> str:
+    return 'size %d, %d solos (%d distinct), %d replicators, %d bound names, %d names' \
+        % (agent.size, len(agent.solos), len(agent.solos.distinct_elements()),
+           len(agent.replicators), len(agent.scope), len(agent.names))
+
+
+def repl(strategy: Strategy = None, lines: Iterable[str] = None, budget: Budget = None):
+    strategy = strategy if strategy else FirstFound()
+    # NOTE: ->* runs under this budget, so a divergent agent is reported rather than looped on
+    budget = budget if budget else Budget(steps=10000, patience=3)
+    lines = iter(lines) if lines is not None else iter(partial(input, '>> '), None)
+    agent = CanonicalAgent(Solo('print', tuple('null'), True))
+    elapsed = 0.0
+    print('solo calculus repl (q to quit, ? for help)...')
+    for user_in in lines:
+        user_in = user_in.strip()
+        started = monotonic()
         if user_in == 'q':
             return
+        elif user_in == '?':
+            print(_help)
+            continue
         elif user_in == '->':
-            agent = agent.reduce()
+            agent = strategy(agent)
+        elif user_in == '->*':
+            try:
+                agent, stopped = reduce(agent, strategy=strategy, budget=budget), None
+                steps = budget.spent
+            except ReductionStopped as stop:
+                agent, steps = stop.agent, stop.steps
+                stopped = str(stop) if isinstance(stop, BudgetExceeded) else 'diverged as %s' % stop
+            elapsed = monotonic() - started
+            print(summary(agent, steps, elapsed, stopped))
+            continue
+        elif user_in.startswith('->'):
+            steps = 0
+            try:
+                target = int(user_in[2:])
+            except ValueError:
+                print('error')
+                continue
+            while steps < target:
+                reduction = strategy(agent)
+                if reduction == agent:
+                    break
+                agent, steps = reduction, steps + 1
+            elapsed = monotonic() - started
+            print(summary(agent, steps, elapsed))
+            continue
+        elif user_in == ':print':
+            pass
+        elif user_in == ':time':
+            print('%.6fs' % elapsed)
+            continue
+        elif user_in == ':stats':
+            print(', '.join('%s %d' % item for item in sorted(counters.items())) or 'no counts')
+            continue
+        elif user_in == ':size':
+            print(metrics(agent))
+            continue
+        elif user_in == ':reset':
+            counters.clear()
+            continue
         elif user_in:
             try:
                 agent = build_agent(user_in)
             except:
                 print('error')
                 continue
+        elapsed = monotonic() - started
         print(agent)
 
 
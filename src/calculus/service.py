@@ -0,0 +1,122 @@
+#! /usr/bin/env python3
+
+from __future__ import annotations
+import asyncio
+import json
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from budget import Budget
+from calculus import CanonicalAgent
+from repl import build_agent, reduce_task, Reduction
+
+
+class Overloaded(Exception):
+    pass
+
+
+
+class ReductionService:
+
+    def __init__(self, executor: Executor = None, max_pending: int = 64,
+                 max_steps: int = 10000, max_time: float = 10.0) -> None:
+        self.executor = executor if executor else ProcessPoolExecutor()
+        self.max_pending = max_pending
+        self.max_steps = max_steps
+        self.max_time = max_time
+        self.pending: Dict[Tuple[CanonicalAgent, int, float], asyncio.Future] = {}
+        self.submitted = 0
+
+
+    async def reduce(self, agent: CanonicalAgent, steps: int = None,
+                     time: float = None) -> Reduction:
+        steps = min(steps, self.max_steps) if steps is not None else self.max_steps
+        time = min(time, self.max_time) if time is not None else self.max_time
+        # NOTE: identical requests in flight share a single reduction
+        key = (agent, steps, time)
+        if key not in self.pending:
+            if len(self.pending) >= self.max_pending:
+                raise Overloaded()
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, reduce_task, (0, agent), None,
+                                          Budget(steps=steps), time)
+            self.pending[key] = future
+            future.add_done_callback(lambda _: self.pending.pop(key, None))
+            self.submitted += 1
+        return await asyncio.shield(self.pending[key])
+
+
+    async def respond(self, method: str, target: str, body: bytes) -> Tuple[int, dict]:
+        url = urlsplit(target)
+        if url.path != '/':
+            return 404, {'error': 'not found'}
+        if method != 'POST':
+            return 405, {'error': 'method not allowed'}
+        query = dict(parse_qsl(url.query))
+        try:
+            steps = int(query['steps']) if 'steps' in query else None
+            time = float(query['time']) if 'time' in query else None
+            # NOTE: parsing is CPU bound as well, so it is left to the executor too
+            agent = await asyncio.get_running_loop().run_in_executor(
+                self.executor, build_agent, body.decode().strip())
+        except Exception as error:
+            return 400, {'error': str(error)}
+        try:
+            reduction = await self.reduce(agent, steps, time)
+        except Overloaded:
+            return 503, {'error': 'too many pending reductions'}
+        except Exception as error:
+            return 500, {'error': str(error)}
+        return 200, {'agent': str(reduction.agent),
+                     'steps': reduction.steps,
+                     'time': reduction.time,
+                     'stopped': reduction.stopped}
+
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            method, target, _ = (await reader.readline()).decode().split(' ', 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode().strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            status, payload = await self.respond(method, target, body)
+        except (ValueError, asyncio.IncompleteReadError):
+            status, payload = 400, {'error': 'malformed request'}
+        data = json.dumps(payload).encode()
+        writer.write(b'HTTP/1.1 %d %s\r\n' % (status, _reasons[status]))
+        if status == 503:
+            writer.write(b'Retry-After: 1\r\n')
+        writer.write(b'Content-Type: application/json\r\n'
+                     b'Content-Length: %d\r\n'
+                     b'Connection: close\r\n\r\n' % len(data))
+        writer.write(data)
+        await writer.drain()
+        writer.close()
+
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8002) -> asyncio.AbstractServer:
+        # NOTE: workers are started lazily, a worker forked while handling a request would
+        #       inherit the client socket and hold the connection open, so start them first
+        await asyncio.get_running_loop().run_in_executor(self.executor, int)
+        return await asyncio.start_server(self.handle, host, port)
+
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8002) -> None:
+        async with await self.start(host, port) as server:
+            await server.serve_forever()
+
+
+_reasons = {200: b'OK', 400: b'Bad Request', 404: b'Not Found',
+            405: b'Method Not Allowed', 500: b'Internal Server Error', 503: b'Service Unavailable'}
+
+
+
+if __name__ == '__main__':
+    from os import getenv
+    asyncio.run(ReductionService().serve(getenv('IP', '0.0.0.0'), int(getenv('PORT', 8002))))
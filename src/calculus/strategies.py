@@ -0,0 +1,103 @@
+#! /usr/bin/env python3
+
+from __future__ import annotations
+from random import Random
+from typing import Dict, Iterator
+
+from calculus import CanonicalAgent, Redex
+
+
+class Strategy:
+
+    def __call__(self, agent: CanonicalAgent) -> CanonicalAgent:
+        return agent.reduce(self)
+
+
+    def select(self, agent: CanonicalAgent, redexes: Iterator[Redex]) -> Redex:
+        raise NotImplementedError
+
+
+
+class FirstFound(Strategy):
+
+    def select(self, agent: CanonicalAgent, redexes: Iterator[Redex]) -> Redex:
+        return next(redexes, None)
+
+
+
+class CheapestFirst(Strategy):
+
+    def select(self, agent: CanonicalAgent, redexes: Iterator[Redex]) -> Redex:
+        return min(redexes, key=lambda redex: redex.growth, default=None)
+
+
+
+class FuseFirst(Strategy):
+
+    @staticmethod
+    def rank(redex: Redex) -> tuple:
+        return (redex.ireplicator is not None, redex.growth)
+
+
+    def select(self, agent: CanonicalAgent, redexes: Iterator[Redex]) -> Redex:
+        # NOTE: solo/solo redexes are always found first, so any one will do
+        redex = next(redexes, None)
+        if redex is None or redex.oreplicator is None:
+            return redex
+        return min([redex, *redexes], key=self.rank)
+
+
+
+class RoundRobin(Strategy):
+
+    def __init__(self) -> None:
+        self.steps = 0
+        self.served: Dict[str, int] = {}
+
+
+    def select(self, agent: CanonicalAgent, redexes: Iterator[Redex]) -> Redex:
+        redex = min(redexes, key=lambda redex: self.served.get(redex.subject, -1), default=None)
+        if redex is not None:
+            self.served[redex.subject] = self.steps
+            self.steps += 1
+        return redex
+
+
+
+class SeededRandom(Strategy):
+
+    def __init__(self, seed: int = 0) -> None:
+        self.random = Random(seed)
+
+
+    @staticmethod
+    def key(redex: Redex) -> tuple:
+        return tuple(map(str, redex[:4]))
+
+
+    def select(self, agent: CanonicalAgent, redexes: Iterator[Redex]) -> Redex:
+        # NOTE: sorted so that a seed gives the same run regardless of hash order
+        redexes = sorted(redexes, key=self.key)
+        return self.random.choice(redexes) if redexes else None
+
+
+
+class MaximalParallel(Strategy):
+
+    def __call__(self, agent: CanonicalAgent) -> CanonicalAgent:
+        return agent.reduce_parallel()
+
+
+    def select(self, agent: CanonicalAgent, redexes: Iterator[Redex]) -> Redex:
+        return next(redexes, None)
+
+
+
+strategies = {
+    'first': FirstFound,
+    'cheapest': CheapestFirst,
+    'fuse': FuseFirst,
+    'round-robin': RoundRobin,
+    'random': SeededRandom,
+    'parallel': MaximalParallel,
+}
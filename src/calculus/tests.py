@@ -1,8 +1,35 @@
 #! /usr/bin/env python3
 
+import asyncio
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
 import unittest
-
-from repl import build_agent, reduce, Agent, CanonicalAgent
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from io import StringIO
+from statistics import median
+from time import monotonic
+
+from multiset import FrozenMultiset as multiset
+
+from repl import build_agent, reduce, reduce_components, reduce_many, repl, Agent, CanonicalAgent
+from calculus import Composition, Replication, Solo, counters
+from codec import dumps, loads, load_checkpoint, save_checkpoint
+import bench
+import cli
+from budget import Budget, BudgetExceeded, Diverged
+from pmap import pmap
+from service import Overloaded, ReductionService
+from strategies import CheapestFirst, FirstFound, FuseFirst, MaximalParallel, RoundRobin, SeededRandom
+
+try:
+    from arrays import SoloArray, reduce_flat
+except ImportError:
+    SoloArray = reduce_flat = None
 
 
 class TestSuiteMeta(type):
@@ -222,6 +249,556 @@ class TestMultiReplicatorFusion(metaclass=TestSuiteMeta):
         assert reduce(agent).alpha_eq(reduction)
 
 
+class TestInteractionAnalysis(metaclass=TestSuiteMeta):
+
+    def test_inert_replicators(self):
+        # no complementary port for ^v, and y is bound inside its replicator
+        agent = build_agent('(x)(u x | !(^u x | p x) | !(^v x) | !(y)(^y x))')
+        print(agent, 'inert:', agent.inert_replicators)
+        assert len(agent.live_replicators) == 1
+        assert len(agent.inert_replicators) == 2
+
+    def test_dead_names(self):
+        agent = build_agent('(x y z)(u x | ^u y | q z)')
+        print(agent, 'dead:', agent.dead_names)
+        assert agent.dead_names == {'z'}
+
+    def test_incremental_ports(self):
+        # fusion merges subjects x and y, making the replicator live
+        agent = build_agent('(x y)(u x y | ^u y x | y z | !(^x z | p z))')
+        reduction = agent.reduce()
+        print(agent, '->', reduction)
+        assert reduction.ports == reduction.flatten().ports
+        assert len(reduction.live_replicators) == 1
+
+
+class TestComponentDecomposition(metaclass=TestSuiteMeta):
+
+    def test_components(self):
+        agent = build_agent('(x y z w)(u x | ^u y | p x y | v z | ^v w | q z w | !(t)(t | ^t))')
+        components = agent.components
+        print(agent, '->', components)
+        assert len(components) == 3
+        assert CanonicalAgent.compose(components).alpha_eq(agent)
+
+    def test_reduce_components(self):
+        agent = build_agent('(x y z w)(u x | ^u y | p x y | v z | ^v w | q z w)')
+        reduction = reduce_components(agent)
+        print(agent, '->', reduction)
+        assert reduction.alpha_eq(reduce(agent))
+
+    def test_reduce_components_pool(self):
+        agent = build_agent('(x y z w)(u x | ^u y | p x y | v z | ^v w | q z w)')
+        reduction = reduce_components(agent, jobs=2)
+        print(agent, '->', reduction)
+        assert reduction.alpha_eq(reduce(agent))
+
+    def test_reduce_components_pool_budget(self):
+        # the budget exception raised in a worker must unpickle in the parent
+        agent = build_agent('(x z)(!(u x) | !(y)(^u y | p y) | !(v z) | !(w)(^v w | q w))')
+        try:
+            reduce_components(agent, jobs=2, budget=Budget(steps=5))
+        except BudgetExceeded as exceeded:
+            print(agent, '->', exceeded)
+            assert exceeded.budget == 'step' and exceeded.steps > 5
+        else:
+            assert False
+
+
+class TestMaximalParallelReduction(metaclass=TestSuiteMeta):
+
+    def test_single_step(self):
+        # two independent fusions fire in one parallel step
+        agent = build_agent('(a b c d)(u a | ^u b | v c | ^v d | p a b c d)')
+        reduction = build_agent('(a c)(p a a c c)')
+        print(agent, '->', agent.reduce_parallel())
+        assert agent.reduce_parallel().alpha_eq(reduction)
+
+    def test_trivialised_redex(self):
+        # the second fusion is made trivial by the first and must not fire
+        agent = build_agent('(x y)(u x | ^u y | v x | ^v y | p x y)')
+        print(agent, '->', reduce(agent, strategy=MaximalParallel()))
+        assert reduce(agent, strategy=MaximalParallel()).alpha_eq(reduce(agent))
+
+    def test_free_name_conflict(self):
+        # x cannot be fused with both free names y and z, so only one fusion fires
+        agent = build_agent('(x)(u x | ^u y | v x | ^v z | p x)')
+        print(agent, '->', agent.reduce_parallel())
+        assert len(agent.reduce_parallel().solos) == 3
+
+    def test_same_normal_form(self):
+        agent = build_agent('(x y)(u x | !(^u y | p x y) | v y | ^v w)')
+        print(agent, '->', reduce(agent, strategy=MaximalParallel()))
+        assert reduce(agent, strategy=MaximalParallel()).alpha_eq(reduce(agent))
+
+
+class TestSoloArray(metaclass=TestSuiteMeta):
+
+    @unittest.skipIf(SoloArray is None, 'numpy is not installed')
+    def test_round_trip(self):
+        agent = build_agent('(x y)(u x y | ^u y x | p x | ^q | !(^p y))')
+        store = SoloArray.from_agent(agent)
+        print(agent, '->', store.to_agent(agent))
+        assert store.to_agent(agent) == agent
+
+    @unittest.skipIf(SoloArray is None, 'numpy is not installed')
+    def test_redexes(self):
+        agent = build_agent('(x y z)(u x | ^u y | ^u z | v x | v y)')
+        inputs, outputs = SoloArray.from_agent(agent).redexes()
+        print(agent, '->', list(zip(inputs.tolist(), outputs.tolist())))
+        assert len(inputs) == len(outputs) == 1
+
+    @unittest.skipIf(SoloArray is None, 'numpy is not installed')
+    def test_same_normal_form(self):
+        for string in ['(a b c d)(u a | ^u b | v c | ^v d | p a b c d)',
+                       '(x y)(u x | ^u y | v x | ^v y | p x y)',
+                       '(x y)(u x | !(^u y | p x y) | v y | ^v w)',
+                       '(x y z w)(u x f | ^u y f | v z f | ^v w f | p x y z w)']:
+            agent = build_agent(string)
+            print(agent, '->', reduce_flat(agent))
+            assert reduce_flat(agent).alpha_eq(reduce(build_agent(string)))
+
+    @unittest.skipIf(SoloArray is None, 'numpy is not installed')
+    def test_shared_free_object(self):
+        def pairs(n):
+            solos = [Solo('c%d' % i, ('x%d' % i, 'f'), False) for i in range(n)] + \
+                    [Solo('c%d' % i, ('y%d' % i, 'f'), True) for i in range(n)]
+            scope = frozenset('x%d' % i for i in range(n)) | frozenset('y%d' % i for i in range(n))
+            return CanonicalAgent((scope, multiset(solos), multiset()))
+
+        def elapsed(n):
+            agent = pairs(n)
+            started = monotonic()
+            assert not reduce_flat(agent).solos
+            return monotonic() - started
+
+        # NOTE: a free name matched with itself fuses nothing, all the pairs fire in one round
+        fused = SoloArray.from_agent(pairs(1000)).fuse()
+        small, large = min(map(elapsed, [2000] * 3)), min(map(elapsed, [8000] * 3))
+        print('fused: %d, 2000 pairs: %.3fs, 8000 pairs: %.3fs' % (fused, small, large))
+        assert fused == 1000 and large < 10 * small
+
+
+class TestReductionStrategies(metaclass=TestSuiteMeta):
+
+    def test_cheapest_first(self):
+        # unfolding the two small replicators is cheaper than the large one
+        agent = build_agent('(x)(u x | !(^u y | p y | q y | r y) | !(z)(v z) | !(^v w))')
+        print(agent, '->', CheapestFirst()(agent))
+        assert len(CheapestFirst()(agent).solos) == 3
+
+    def test_fuse_first(self):
+        agent = build_agent('(x)(u x | v x | !(^u y | p y | q y) | !(^v y))')
+        print(agent, '->', FuseFirst()(agent))
+        assert len(FuseFirst()(agent).solos) == 3
+
+    def test_round_robin(self):
+        # both subjects are served before either is served twice
+        agent = build_agent('(!(^u x) | !(y)(u y) | !(^v x) | !(y)(v y))')
+        strategy = RoundRobin()
+        reduction = strategy(strategy(agent))
+        print(agent, '->', reduction)
+        assert {solo.subject for solo in reduction.solos} == {'u', 'v'}
+
+    def test_seeded_random(self):
+        agent = build_agent('(x y z)(u x | ^u y | ^u z | p x y z)')
+        print(agent, '->', SeededRandom(1)(agent))
+        assert SeededRandom(1)(agent) == SeededRandom(1)(agent)
+
+    def test_same_normal_form(self):
+        agent = build_agent('(a b c d)(u a | ^u b | v c | !(^v d) | p a b c d)')
+        for strategy in [CheapestFirst(), FuseFirst(), RoundRobin()]:
+            reduction = reduce(agent, strategy=strategy)
+            print(type(strategy).__name__, agent, '->', reduction)
+            assert reduction.alpha_eq(reduce(agent))
+
+
+class TestDivergenceDetection(metaclass=TestSuiteMeta):
+
+    def test_pumping_residue(self):
+        # every unfolding leaves another p x behind, under a fresh name for x
+        agent = build_agent('(x)(!(u x) | !(y)(^u y | p y))')
+        try:
+            reduce(agent, budget=Budget(steps=100, patience=3))
+        except Diverged as divergence:
+            print(agent, '->', divergence)
+            assert divergence.period == 2
+            assert [solo.subject for solo in divergence.residue.solos] == ['p']
+        else:
+            assert False
+
+    def test_step_budget(self):
+        agent = build_agent('(x)(!(u x) | !(y)(^u y | p y))')
+        try:
+            reduce(agent, budget=Budget(steps=5))
+        except BudgetExceeded as exceeded:
+            print(agent, '->', exceeded)
+            assert exceeded.budget == 'step'
+        else:
+            assert False
+
+    def test_size_budget(self):
+        agent = build_agent('(x)(!(u x) | !(y)(^u y | p y))')
+        try:
+            reduce(agent, budget=Budget(size=10))
+        except BudgetExceeded as exceeded:
+            print(agent, '->', exceeded)
+            assert exceeded.agent.size > 10
+        else:
+            assert False
+
+    def test_terminating(self):
+        agent = build_agent('(x y)(!(u x | ^u y) | p x y)')
+        reduction = build_agent('(x)(p x x | u x | ^u x | !(u x | ^u x))')
+        print(agent, '->', reduce(agent, budget=Budget(steps=100, patience=3)))
+        assert reduce(agent, budget=Budget(steps=100, patience=3)).alpha_eq(reduction)
+
+
+
+class TestPersistentMap(metaclass=TestSuiteMeta):
+
+    def test_structural_sharing(self):
+        base = pmap(('x%d' % i, 'y') for i in range(100))
+        extended = base.set('z', 'y')
+        shared = [i for i in base._root if base._root[i] is extended._root.get(i)]
+        print(len(base), '->', len(extended), 'shared:', len(shared))
+        assert 'z' not in base and extended['z'] == 'y'
+        assert len(base) == 100 and len(extended) == 101
+        assert len(shared) >= len(base._root) - 1
+
+    def test_hash_equality(self):
+        a = pmap({'x': 'u', 'y': 'v'}).set('z', 'w')
+        b = pmap(z='w', y='v', x='u')
+        print(a, b)
+        assert a == b and hash(a) == hash(b)
+        assert a != b.set('z', 'u')
+        assert len({a, b}) == 1
+
+    def test_merge_conflict(self):
+        a, b, c = pmap(x='u'), pmap(x='u', y='v'), pmap(y='w')
+        print(a.merge(b), b.merge(c))
+        assert a.merge(b) == b
+        assert b.merge(c) is None
+        assert b.update(c)['y'] == 'w'
+
+
+
+class TestSerialisation(metaclass=TestSuiteMeta):
+
+    def test_round_trip(self):
+        agent = build_agent('(x y)(u x y | ^u y x | !(z)(^x z | !(w)(p z w)) | q)')
+        data = dumps(agent)
+        print(agent, '->', len(data), 'bytes ->', loads(data))
+        assert loads(data) == agent
+        assert len(data) < len(str(agent).encode()) * 4
+
+    def test_pickle(self):
+        agent = build_agent('(x)(u x | !(^u x | p x))')
+        print(agent, '->', pickle.loads(pickle.dumps(agent)))
+        assert pickle.loads(pickle.dumps(agent)) == agent
+
+    def test_version_mismatch(self):
+        data = bytearray(dumps(build_agent('(x)(u x)')))
+        data[4] += 1
+        try:
+            loads(bytes(data))
+        except ValueError as error:
+            print(error)
+        else:
+            assert False
+
+    def test_checkpoint_resume(self):
+        agent = build_agent('(x y)(!(u x | ^u y) | p x y)')
+        reduction = reduce(agent)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'checkpoint')
+            save_checkpoint(path, agent, agent.reduce())
+            resumed = reduce(agent, checkpoint=path, interval=1)
+            print(agent, '->', resumed)
+            assert resumed.alpha_eq(reduction)
+            assert load_checkpoint(path)[1] == resumed
+
+
+
+class Failing(FirstFound):
+    # NOTE: defined at module level so that pool workers can unpickle it
+
+    def __call__(self, agent: CanonicalAgent) -> CanonicalAgent:
+        if any(solo.subject == 'fail' for solo in agent.solos):
+            raise ValueError('cannot reduce %s' % agent)
+        return super().__call__(agent)
+
+
+
+class TestBatchReduction(metaclass=TestSuiteMeta):
+
+    agents = ['(x y)(u x | ^u y | p x y)',
+              '(x)(u x | !(^u x | p x))',
+              '(x y)(!(u x | ^u y) | p x y)']
+
+    def test_ordered(self):
+        agents = [build_agent(agent) for agent in self.agents]
+        results = list(reduce_many(agents, jobs=2, chunksize=2))
+        for agent, result in zip(agents, results):
+            print(agent, '->', result.agent, result.steps, 'steps')
+        assert [result.index for result in results] == [0, 1, 2]
+        assert all(result.stopped is None for result in results)
+        assert all(result.agent.alpha_eq(reduce(agent)) for agent, result in zip(agents, results))
+
+    def test_unordered(self):
+        agents = [build_agent(agent) for agent in self.agents]
+        results = list(reduce_many(agents, jobs=2, ordered=False))
+        print([(result.index, result.steps) for result in results])
+        assert sorted(result.index for result in results) == [0, 1, 2]
+
+    def test_timeout(self):
+        agents = [build_agent('(x)(!(u x) | !(y)(^u y | p y))'), build_agent(self.agents[0])]
+        results = list(reduce_many(agents, jobs=2, timeout=0.5))
+        print([result.stopped for result in results])
+        assert results[0].stopped == 'time budget exceeded after %d steps' % results[0].steps
+        assert results[1].stopped is None and results[1].steps == 1
+
+    def test_failure(self):
+        agents = [build_agent(self.agents[0]), build_agent('fail x'), build_agent(self.agents[2])]
+        results = list(reduce_many(agents, jobs=2, strategy=Failing()))
+        print([result.stopped for result in results])
+        assert results[1].stopped.startswith('ValueError: cannot reduce')
+        assert results[1].agent == agents[1]
+        assert results[0].stopped is None and results[2].stopped is None
+
+
+
+class TestReductionService(metaclass=TestSuiteMeta):
+
+    def test_coalescing(self):
+        service = ReductionService(ThreadPoolExecutor(2))
+        agent = build_agent('(x y)(u x | ^u y | p x y)')
+
+        async def run():
+            return await asyncio.gather(*[service.reduce(agent) for _ in range(4)])
+        reductions = asyncio.run(run())
+        print(agent, '->', reductions[0].agent, 'submitted:', service.submitted)
+        assert service.submitted == 1 and not service.pending
+        assert all(reduction.agent == reductions[0].agent for reduction in reductions)
+
+    def test_backpressure(self):
+        service = ReductionService(ThreadPoolExecutor(2), max_pending=1)
+        agents = [build_agent('(x y)(u x | ^u y | p x y)'), build_agent('(x)(u x | !(^u x | p x))')]
+
+        async def run():
+            return await asyncio.gather(*map(service.reduce, agents), return_exceptions=True)
+        reductions = asyncio.run(run())
+        print(reductions)
+        assert isinstance(reductions[1], Overloaded)
+
+    def test_http(self):
+        service = ReductionService(ThreadPoolExecutor(2), max_time=0.5)
+
+        async def post(port, path, body):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'POST %s HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s'
+                         % (path, len(body), body))
+            response = await reader.read()
+            writer.close()
+            head, _, data = response.partition(b'\r\n\r\n')
+            return int(head.split()[1]), json.loads(data)
+
+        async def run():
+            server = await service.start(port=0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                return await asyncio.gather(
+                    post(port, b'/', b'(x y)(u x | ^u y | p x y)'),
+                    post(port, b'/?steps=5', b'(x)(!(u x) | !(y)(^u y | p y))'),
+                    post(port, b'/', b'(x'))
+        (ok, normal), (stopped, diverged), (bad, _) = asyncio.run(run())
+        print(normal, diverged)
+        assert (ok, stopped, bad) == (200, 200, 400)
+        assert build_agent(normal['agent']).alpha_eq(build_agent('(u0)(p u0 u0)'))
+        assert diverged['stopped'] == 'step budget exceeded after 6 steps'
+
+    def test_http_process_pool(self):
+        service = ReductionService(max_time=0.5)
+
+        async def run():
+            server = await service.start(port=0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                body = b'(x y)(u x | ^u y | p x y)'
+                writer.write(b'POST / HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s' % (len(body), body))
+                # NOTE: the response must end with the connection, not when the pool shuts down
+                response = await asyncio.wait_for(reader.read(), 10)
+                writer.close()
+                return response
+        try:
+            response = asyncio.run(run())
+        finally:
+            service.executor.shutdown()
+        print(response.partition(b'\r\n')[0].decode())
+        assert response.startswith(b'HTTP/1.1 200') and response.endswith(b'"stopped": null}')
+
+
+
+class TestPrinting(metaclass=TestSuiteMeta):
+
+    def test_format(self):
+        agent = build_agent('(x)(u x y | !(z)(^x z))')
+        print(agent)
+        assert str(agent) == '(x)(u x y | !(z)(\u0305x z))'
+        assert str(build_agent('(x)(!(u x))')) == '(x)(!()(u x))'
+
+    def test_truncation(self):
+        agent = build_agent('(%s)(%s)' % (' '.join('x%d' % i for i in range(1000)),
+                                          ' | '.join('u x%d' % i for i in range(1000))))
+        text = agent.format(limit=40)
+        print(text)
+        assert len(text) == 43 and text.endswith('...')
+        assert str(agent).startswith(text[:-3])
+
+    def test_elision(self):
+        agent = build_agent('(x)(p x | !(^p x))')
+        nested = Replication(Composition(multiset([Solo('p', ('x',), True),
+                                                   Replication(Solo('q', (), True))])))
+        print(agent.format(depth=0), nested.format(depth=1))
+        assert agent.format(depth=0) == '(x)(p x | !...)'
+        assert nested.format(depth=1) in ('!(p x | !...)', '!(!... | p x)')
+
+
+
+class TestDefinitions(metaclass=TestSuiteMeta):
+
+    def test_instantiation(self):
+        agent = build_agent('let P(x y) = (z)(u x z | ^z y); (P(a b) | P(b c))')
+        expanded = build_agent('((z)(u a z | ^z b) | (z)(u b z | ^z c))')
+        print(agent, expanded)
+        assert agent.alpha_eq(expanded)
+
+    def test_capture(self):
+        agent = build_agent('let P(x) = (z)(u x z); P(z)')
+        print(agent)
+        assert agent.free_names == {'u', 'z'} and len(agent.scope) == 1
+
+    def test_nested_definitions(self):
+        agent = build_agent('let P(x) = (p x); let Q(y) = (P(y) | !P(y)); (q w | Q(w))')
+        expanded = build_agent('(q w | p w | !(p w))')
+        print(agent, expanded)
+        assert agent.alpha_eq(expanded)
+
+    def test_undefined(self):
+        try:
+            build_agent('let P(x) = (p x); Q(x)')
+        except Exception as error:
+            print(error)
+            assert 'Q' in str(error)
+        else:
+            assert False
+
+
+
+class TestCommandLine(metaclass=TestSuiteMeta):
+
+    def test_json(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.solo', delete=False) as file:
+            file.write('# comment\n(x y)(u x | ^u y | p x y)\n(x)(!(u x) | !(y)(^u y | p y))\n')
+        out = StringIO()
+        try:
+            assert cli.main([file.name, '--format', 'json', '--stats', '--max-steps', '5'], out) == 0
+        finally:
+            os.remove(file.name)
+        records = list(map(json.loads, out.getvalue().splitlines()))
+        print(records)
+        assert [record['steps'] for record in records] == [1, 6]
+        assert records[1]['stopped'] == 'step budget exceeded after 6 steps'
+
+    def test_jobs_validated(self):
+        result = subprocess.run([sys.executable, 'cli.py', '--jobs', '0'], input='p x\n',
+                                capture_output=True, text=True)
+        print(result.stderr.strip())
+        assert result.returncode == 2 and 'must be at least 1' in result.stderr
+
+    def test_budgets_validated(self):
+        for option, value, error in [('--max-steps', '-3', 'must be at least 1'),
+                                     ('--timeout', '-1', 'must be greater than 0'),
+                                     ('--timeout', '0', 'must be greater than 0')]:
+            result = subprocess.run([sys.executable, 'cli.py', option, value], input='p x\n',
+                                    capture_output=True, text=True)
+            print(option, value, result.stderr.strip().splitlines()[-1])
+            assert result.returncode == 2 and error in result.stderr
+
+    def test_lazy_imports(self):
+        loaded = subprocess.run([sys.executable, '-c', 'import cli, sys; '
+                                 'print(*sorted({"regex", "multiset", "calculus"} & set(sys.modules)))'],
+                                capture_output=True, text=True).stdout.strip()
+        print('loaded:', loaded)
+        assert loaded == ''
+
+    def test_startup_budget(self):
+        def startup():
+            started = monotonic()
+            subprocess.run([sys.executable, 'cli.py', '--help'], capture_output=True, check=True)
+            return monotonic() - started
+        elapsed = median(startup() for _ in range(5))
+        print('startup: %.3fs' % elapsed)
+        assert elapsed < cli.STARTUP_BUDGET
+
+
+
+class TestReplCommands(metaclass=TestSuiteMeta):
+
+    def session(self, *lines):
+        out = StringIO()
+        with redirect_stdout(out):
+            repl(lines=[*lines, 'q'])
+        return out.getvalue().splitlines()[1:]
+
+    def test_multi_step(self):
+        output = self.session('(x)(!(u x) | !(y)(^u y | p y))', '-> 6', '-> x')
+        print(*output, sep='\n')
+        assert output[1].startswith('6 steps, 3 solos, 2 replicators')
+        assert output[2] == 'error'
+
+    def test_normal_form(self):
+        output = self.session('(x y)(u x | ^u y | p x y)', '->*', ':print')
+        print(*output, sep='\n')
+        assert output[1].startswith('1 steps, 1 solos, 0 replicators')
+        assert output[1].endswith('(u0)(p u0 u0)') and output[2] == '(u0)(p u0 u0)'
+
+    def test_normal_form_divergent(self):
+        output = self.session('(x)(!(u x) | !(y)(^u y | p y))', '->*')
+        print(*output, sep='\n')
+        assert 'stopped: diverged as' in output[1]
+
+    def test_counters(self):
+        output = self.session('(x)(!(u x) | !(y)(^u y | p y))', ':reset', '-> 2', ':stats', ':size')
+        print(*output, sep='\n')
+        assert counters['fusions'] == 1 and counters['replicator firings'] == 2
+        assert 'fusions 1' in output[2] and 'replicator firings 2' in output[2]
+        assert output[3].startswith('size 4, 1 solos')
+
+
+
+class TestDifferentialBenchmark(metaclass=TestSuiteMeta):
+
+    def test_engines_agree(self):
+        agents = list(bench.generate(10, seed=1))
+        reports = bench.run(agents)
+        print(bench.table(reports))
+        assert [report.engine for report in reports] == list(bench.engines)
+        assert all(report.mismatches == 0 for report in reports)
+        assert all(report.p50 <= report.p95 <= report.p99 for report in reports)
+
+    def test_mismatch_detected(self):
+        agents = list(bench.generate(3, seed=2))
+        bench.engines['identity'] = lambda agent: agent
+        try:
+            reports = bench.run(agents, ['identity'])
+        finally:
+            del bench.engines['identity']
+        print(bench.table(reports))
+        assert reports[0].mismatches == 3
+
+
 if __name__ == '__main__':
     runner = unittest.TextTestRunner()
     for suite in TestSuiteMeta.full_suite:
@@ -1,8 +1,10 @@
 #! /usr/bin/env python3
 
 from __future__ import annotations
-from collections.abc import Iterable
-from functools import reduce
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+from itertools import count
+from threading import Lock
 from uuid import uuid4
 
 from multiset import FrozenMultiset as multiset
@@ -16,6 +18,78 @@ def typefilter(iterable: Iterable, obj_t: type) -> set:
     return set(filter(lambda obj: isinstance(obj, obj_t), iterable))
 
 
+def carry(index: dict, removed: Iterable, added: Iterable, keys) -> dict:
+    '''
+    Copy of an incidence index with removed items dropped and added items
+    inserted, touching only the entries under their keys.
+    '''
+    index = dict(index)
+    for item in removed:
+        for key in keys(item):
+            index[key] = [other for other in index[key] if other != item]
+            if not index[key]:
+                del index[key]
+    for item in added:
+        for key in keys(item):
+            index[key] = index.get(key, []) + [item]
+    return index
+
+
+def patch(old: multiset, new: multiset) -> dict:
+    '''
+    The json patch between two multisets of edges or boxes. Items are matched
+    by id, so an item rewritten by a substitution is sent as renamed.
+    '''
+    gone: dict = {}
+    for item in old.difference(new):
+        gone.setdefault(item._uuid, []).append(item)
+    added, renamed = [], []
+    for item in new.difference(old):
+        if gone.get(item._uuid):
+            gone[item._uuid].pop()
+            renamed.append(item.json)
+        else:
+            added.append(item.json)
+    return {'added': added,
+            'removed': [ids.render(uuid) for uuid, items in gone.items() for _ in items],
+            'renamed': renamed}
+
+
+
+class Ids:
+    '''
+    Allocator of identifiers unique within a session.
+    Ids are integers from a monotonic counter and are only rendered as strings,
+    behind a random prefix drawn once per session, when they reach JSON.
+    The prefix keeps them apart from ids posted back from an earlier session.
+    '''
+
+    def __init__(self) -> None:
+        self.prefix = uuid4().hex[:8]
+        self.next = count().__next__
+
+
+    def __call__(self) -> int:
+        return self.next()
+
+
+    def render(self, uuid) -> str:
+        return uuid if isinstance(uuid, str) else '%s.%x' % (self.prefix, uuid)
+
+
+    def parse(self, uuid: str):
+        '''
+        The counter value behind an id rendered in this session, other ids as they are.
+        '''
+        if not isinstance(uuid, str):
+            return uuid
+        prefix, _, n = uuid.partition('.')
+        return int(n, 16) if prefix == self.prefix else uuid
+
+
+ids = Ids()
+
+
 
 class pair(tuple):
 
@@ -42,7 +116,7 @@ class Node(str):
     size = 10
 
     def __new__(cls, name: str = None, uuid: str = None) -> Node:
-        uuid = uuid if uuid else str(uuid4())
+        uuid = uuid if uuid else ids.render(ids())
         obj = super().__new__(cls, uuid)
         obj._name = name
         obj._uuid = uuid
@@ -75,8 +149,43 @@ class Node(str):
 
 
     @staticmethod
-    def from_json(json: dict, nodes: dict = {}) -> Node:
-        return Node(json['title'], json['id'])
+    def from_json(json: dict, nodes: dict = None) -> Node:
+        # NOTE: nodes interns one node per id for the document being read
+        nodes = {} if nodes is None else nodes
+        if json['id'] not in nodes:
+            nodes[json['id']] = pool.get(json['id'], json['title'])
+        return nodes[json['id']]
+
+
+
+class NodePool:
+    '''
+    A bounded pool of the nodes most recently read from JSON, so that the
+    nodes of a diagram posted back and forth are reused rather than rebuilt.
+    '''
+
+    def __init__(self, maxsize: int = 4096) -> None:
+        self.maxsize = maxsize
+        self.nodes: OrderedDict = OrderedDict()
+        self.lock = Lock()
+
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+
+    def get(self, uuid: str, name: str) -> Node:
+        with self.lock:
+            node = self.nodes.pop((uuid, name), None)
+            if node is None:
+                node = Node(name, uuid)
+            self.nodes[(uuid, name)] = node
+            if len(self.nodes) > self.maxsize:
+                self.nodes.popitem(last=False)
+        return node
+
+
+pool = NodePool()
 
 
 
@@ -100,22 +209,29 @@ class Edge(tuple):
             assert isinstance(node, Node)
         self.subject: Node = self[0]
         self.objects = self[1:]
-        self._node = HiddenNode(uuid=uuid)
-        self._uuid = uuid if uuid else str(uuid4())
+        self._uuid = uuid if uuid is not None else ids()
         self.arity = len(self.objects)
 
 
     @property
-    def _uuid(self) -> str:
+    def _uuid(self):
         return self.__uuid
 
 
     @_uuid.setter
-    def _uuid(self, value: str):
+    def _uuid(self, value):
         self.__uuid = value
-        # Leaving this on causes edges to 'stick' on reduction
-        # Leaving this off causes edges to 'tug' inwards on reduction
-        self._node._uuid = value
+        self.__dict__.pop('_hidden', None)
+
+
+    @property
+    def _node(self) -> HiddenNode:
+        # NOTE: only rendering needs the hidden node, so it is made on demand
+        # Sharing the edge id causes edges to 'stick' on reduction
+        # A fresh id causes edges to 'tug' inwards on reduction
+        if '_hidden' not in self.__dict__:
+            self._hidden = HiddenNode(uuid=ids.render(self._uuid))
+        return self._hidden
 
 
     @property
@@ -125,26 +241,25 @@ class Edge(tuple):
     
     @property
     def json(self) -> list:
+        uuid, hidden = ids.render(self._uuid), self._node._uuid
         if type(self) == Input:
-            arrow = 1
-            source = self.subject.json['id']
-            target = self._node.json['id']
+            arrow, source, target = 1, self.subject._uuid, hidden
         else:
-            arrow = -1
-            source = self._node.json['id']
-            target = self.subject.json['id']
-        return [{'source': source, 'target': target, 'value': 1, 'arrow': arrow}] + \
-                [{'source': self._node.json['id'], 'target': obj.json['id'],
-                  'value': 1, 'arrow': 0, 'id': self._uuid}
+            arrow, source, target = -1, hidden, self.subject._uuid
+        return [{'source': source, 'target': target, 'value': 1, 'arrow': arrow, 'id': uuid}] + \
+                [{'source': hidden, 'target': obj._uuid, 'value': 1, 'arrow': 0, 'id': uuid}
                  for obj in self.objects]
 
     @staticmethod
-    def from_json(json: list, nodes: dict = {}) -> Edge:
+    def from_json(json: list, nodes: dict = None, index: dict = None) -> Edge:
+        # NOTE: endpoints are node objects once d3 has linked them, otherwise ids into index
+        nodes = {} if nodes is None else nodes
         parity = json[0]['arrow'] == 1
-        subject = json[0]['source' if parity else 'target']['id']
-        uuid = json[1]['id']
-        objects = list(map(lambda x: x['target']['id'], json[1:]))
-        return (Input if parity else Output)(map(nodes.get, [subject] + objects), uuid=uuid)
+        subject = json[0]['source' if parity else 'target']
+        objects = [link['target'] for link in json[1:]]
+        return (Input if parity else Output)((Node.from_json(j if isinstance(j, dict) else index[j], nodes)
+                                              for j in [subject] + objects),
+                                             uuid=ids.parse(json[-1]['id']))
 
 
 
@@ -170,35 +285,88 @@ class Graph(multiset):
 
     def __init__(self, *args, uuid: str = None) -> None:
         super().__init__(*args)
-        for edge in self:
-            assert isinstance(edge, Edge)
-        self._uuid = uuid if uuid else str(uuid4())
+        if not (args and isinstance(args[0], Graph)):
+            for edge in self.distinct_elements():
+                assert isinstance(edge, Edge)
+        self._uuid = uuid if uuid is not None else ids()
+
+
+    def replace(self, removed: Iterable[Edge], added: Iterable[Edge]) -> Graph:
+        '''
+        The graph with removed edges swapped for added edges, carrying over
+        whichever indexes have already been built.
+        '''
+        removed, added = multiset(removed), multiset(added)
+        ret = self.difference(removed).combine(added)
+        ret._uuid = self._uuid
+        gone = [edge for edge in removed.distinct_elements() if edge not in ret]
+        new = [edge for edge in added.distinct_elements() if edge not in self]
+        if '_incidence' in self.__dict__:
+            ret._incidence = carry(self._incidence, gone, new, lambda edge: edge.nodes)
+        if '_ports' in self.__dict__:
+            ret._ports = carry(self._ports, gone, new,
+                               lambda edge: [(edge.subject, edge.arity, type(edge))])
+        return ret
+
+
+    @property
+    def incidence(self) -> dict:
+        '''
+        Incidence index from each node to the distinct edges containing it.
+        '''
+        # NOTE: indexes are built aside and published whole, diagrams are shared between threads
+        if '_incidence' not in self.__dict__:
+            incidence: dict = {}
+            for edge in self.distinct_elements():
+                for node in edge.nodes:
+                    incidence.setdefault(node, []).append(edge)
+            self._incidence = incidence
+        return self._incidence
 
 
     @property
     def nodes(self) -> set:
-        return reduce(lambda a, b: a | b, (edge.nodes for edge in self), set())
+        if '_nodes' not in self.__dict__:
+            self._nodes = set(self.incidence)
+        return self._nodes
 
 
     @property
     def edges(self) -> set:
-        return set(self)
+        if '_edges' not in self.__dict__:
+            self._edges = set(self.distinct_elements())
+        return self._edges
+
+
+    @property
+    def ports(self) -> dict:
+        '''
+        Incidence index of edges keyed by (subject, arity, polarity).
+        '''
+        if '_ports' not in self.__dict__:
+            ports: dict = {}
+            for edge in self.distinct_elements():
+                ports.setdefault((edge.subject, edge.arity, type(edge)), []).append(edge)
+            self._ports = ports
+        return self._ports
 
 
     @property
     def json(self) -> dict:
         return {
             'nodes': [node.json for node in (self.nodes | {edge._node for edge in self})],
-            'edges': reduce(lambda a, b: a + [b.json], self, []),
-            'id': self._uuid
+            'edges': [edge.json for edge in self],
+            'id': ids.render(self._uuid)
         }
     
 
     @staticmethod
-    def from_json(json: dict, nodes: dict = {}) -> Graph:
-        for j in json['nodes']:
-            nodes[j['id']] = Node.from_json(j, nodes)
-        return Graph([Edge.from_json(j, nodes) for j in json['edges']], uuid=json['id'])
+    def from_json(json: dict, nodes: dict = None) -> Graph:
+        # NOTE: nodes are read from the edge endpoints, hidden nodes are never built
+        nodes = {} if nodes is None else nodes
+        index = {j['id']: j for j in json['nodes']}
+        return Graph([Edge.from_json(j, nodes, index) for j in json['edges']],
+                     uuid=ids.parse(json['id']))
 
 
 
@@ -219,36 +387,29 @@ class Box(pair):
         assert internals <= graph.nodes
         self.graph = graph
         self.internals = internals
-        self._uuid = uuid if uuid else str(uuid4())
+        self.principals = graph.nodes - internals
+        self._uuid = uuid if uuid is not None else ids()
         for node in self.graph.nodes:
-            node.group = 2
-        for node in self.principals:
-            node.group = 3
-       
-        
+            node.group = 2 if node in internals else 3
+
 
     @property
     def nodes(self) -> set:
         return self.graph.nodes
 
 
-    @property
-    def principals(self) -> set:
-        return self.nodes - self.internals
-
-
     @property
     def json(self) -> dict:
-        return {'id': self._uuid,
+        return {'id': ids.render(self._uuid),
                 'graph': self.graph.json,
                 'perimeter': [node.json for node in self.principals]}
 
 
     @staticmethod
-    def from_json(json: dict, nodes: dict = {}) -> Box:
+    def from_json(json: dict, nodes: dict = None) -> Box:
         graph = Graph.from_json(json['graph'], nodes)
         internals = graph.nodes - set(map(lambda x: x['id'], json['perimeter']))
-        return Box((graph, internals), uuid=json['id'])
+        return Box((graph, internals), uuid=ids.parse(json['id']))
 
 
 
@@ -257,26 +418,81 @@ class Boxes(multiset):
     A typechecked multiset of boxes, M.
     '''
 
+    def __new__(cls, *args, uuid: str = None, **kwargs) -> Boxes:
+        return super().__new__(cls, *args, **kwargs)
+
+
     def __init__(self, *args, uuid: str = None):
         super().__init__(*args)
-        for box in self:
-            assert isinstance(box, Box)
-        self._uuid = uuid if uuid else str(uuid4())
+        if not (args and isinstance(args[0], Boxes)):
+            for box in self.distinct_elements():
+                assert isinstance(box, Box)
+        self._uuid = uuid if uuid is not None else ids()
+
+
+    def replace(self, removed: Iterable[Box], added: Iterable[Box]) -> Boxes:
+        '''
+        The boxes with removed boxes swapped for added boxes, carrying over
+        the node incidence index if it has already been built.
+        '''
+        removed, added = multiset(removed), multiset(added)
+        ret = self.difference(removed).combine(added)
+        ret._uuid = self._uuid
+        if '_incidence' in self.__dict__:
+            ret._incidence = carry(self._incidence,
+                                   [box for box in removed.distinct_elements() if box not in ret],
+                                   [box for box in added.distinct_elements() if box not in self],
+                                   lambda box: box.nodes)
+        return ret
+
+
+    @property
+    def incidence(self) -> dict:
+        '''
+        Incidence index from each node to the distinct boxes containing it.
+        '''
+        if '_incidence' not in self.__dict__:
+            incidence: dict = {}
+            for box in self.distinct_elements():
+                for node in box.nodes:
+                    incidence.setdefault(node, []).append(box)
+            self._incidence = incidence
+        return self._incidence
 
 
     @property
     def nodes(self) -> set:
-        return reduce(lambda a, b: a | b, (box.nodes for box in self), set())
+        if '_nodes' not in self.__dict__:
+            self._nodes = set(self.incidence)
+        return self._nodes
 
 
     @property
     def internals(self) -> set:
-        return reduce(lambda a, b: a | b, (box.internals for box in self), set())
+        if '_internals' not in self.__dict__:
+            self._internals = set().union(*(box.internals for box in self.distinct_elements()))
+        return self._internals
 
 
     @property
     def principals(self) -> set:
-        return reduce(lambda a, b: a | b, (box.internals for box in self), set())
+        if '_principals' not in self.__dict__:
+            self._principals = set().union(*(box.principals for box in self.distinct_elements()))
+        return self._principals
+
+
+    @property
+    def ports(self) -> dict:
+        '''
+        Incidence index of (box, edge) pairs keyed by (subject, arity, polarity).
+        '''
+        if '_ports' not in self.__dict__:
+            ports: dict = {}
+            for box in self.distinct_elements():
+                for key, edges in box.graph.ports.items():
+                    ports.setdefault(key, []).extend((box, edge) for edge in edges)
+            self._ports = ports
+        return self._ports
 
 
     @property
@@ -285,7 +501,8 @@ class Boxes(multiset):
 
     
     @staticmethod
-    def from_json(json: list, nodes: dict = {}) -> Boxes:
+    def from_json(json: list, nodes: dict = None) -> Boxes:
+        nodes = {} if nodes is None else nodes
         return Boxes([Box.from_json(j, nodes) for j in json])
 
 
@@ -313,50 +530,150 @@ class Map(dict):
 class Sigma(Map):
 
     def __init__(self, alpha: Edge = None, beta: Edge = None, from_dict = None) -> None:
-        if from_dict:
+        if from_dict is not None:
             super().__init__(from_dict)
         else:
             super().__init__()
-            if alpha.subject == beta.subject and alpha.arity == beta.arity:
-                g = graph()
-                for edge in zip(alpha.objects, beta.objects):
-                    g.insert_edge(*edge)
-                for partition in g.partitions():
-                    intersect = set(filter(lambda x: x.named, partition))
-                    if len(intersect) == 0:
-                        free_node, *_ = partition
-                    elif len(intersect) == 1:
-                        free_node, *_ = intersect
-                    else:
-                        raise Exception('No such sigma exists - not enough free nodes')
-                    for node in partition - {free_node}:
-                        self[node] = free_node
-                assert not self.range & self.domain
-            else:
+            if not (alpha.subject == beta.subject and alpha.arity == beta.arity):
                 raise Exception('No such sigma exists - nonmatching edges')
+            if not self.fuse(alpha, beta):
+                raise Exception('No such sigma exists - not enough free nodes')
+
+
+    def fuse(self, alpha: Edge, beta: Edge) -> bool:
+        g = graph()
+        for edge in zip(alpha.objects, beta.objects):
+            g.insert_edge(*edge)
+        for partition in g.partitions():
+            intersect = set(filter(lambda x: x.named, partition))
+            if len(intersect) == 0:
+                free_node, *_ = partition
+            elif len(intersect) == 1:
+                free_node, *_ = intersect
+            else:
+                return False
+            for node in partition - {free_node}:
+                self[node] = free_node
+        assert not self.range & self.domain
+        return True
+
+
+    @staticmethod
+    def from_edges(alpha: Edge, beta: Edge) -> Sigma:
+        '''
+        The sigma fusing alpha with beta, or None if no such sigma exists.
+        Callers are expected to have matched subject and arity already.
+        '''
+        sigma = Sigma(from_dict={})
+        return sigma if sigma.fuse(alpha, beta) else None
 
 
     def __call__(self, obj):
+        if isinstance(obj, (Graph, Boxes)):
+            # NOTE: only what touches the domain is rebuilt, the rest is shared
+            touched = set(item for node in self.domain & obj.nodes for item in obj.incidence[node])
+            if not touched:
+                return obj
+            removed = multiset({item: obj[item] for item in touched})
+            return obj.replace(removed, [self(item) for item in removed])
         ret = super().__call__(obj)
-        if hasattr(obj, '_uuid'):
+        # NOTE: renamed edges and boxes keep their id, a node is its id so is never retagged
+        if hasattr(obj, '_uuid') and not isinstance(obj, Node):
             ret._uuid = obj._uuid
         return ret
 
 
 
-class Rho(Map):
+class Instance:
+    '''
+    A copy of a box made by reduction, instantiated copy-on-write.
+    Template edges are only renamed into the diagram once they take part in a
+    reduction or a render. Copies made by the same reduction share one table of names.
+    '''
+
+    def __init__(self, box: Box, internals: set = None, scope: set = None,
+                 names: dict = None, uuids: dict = None,
+                 consumed: multiset = multiset()) -> None:
+        self.box = box
+        self.internals = internals if internals is not None else box.internals
+        self.scope = scope if scope is not None else box.nodes
+        self.names = names if names is not None else {}
+        self.uuids = uuids if uuids is not None else {}
+        self.consumed = consumed
+        self._edges: dict = {}
 
-    def __init__(self, box_internals: set) -> None:
-        super().__init__()
-        for node in box_internals:
-            self[node] = Node(node.name if node.named else None)
 
+    def node(self, node: Node) -> Node:
+        # NOTE: setdefault, so that threads racing on a shared table agree on one fresh node
+        if node not in self.names:
+            if node not in self.internals:
+                return node
+            return self.names.setdefault(node, Node(node.name if node.named else None))
+        return self.names[node]
 
-    def __call__(self, obj):
-        if isinstance(obj, Sigma):
-            return type(obj)(from_dict=[self(item) for item in obj.items()])
-        else:
-            return super().__call__(obj)
+
+    def edge(self, edge: Edge) -> Edge:
+        if edge not in self._edges:
+            uuid = self.uuids.setdefault(edge, ids())
+            return self._edges.setdefault(edge, type(edge)(map(self.node, edge), uuid=uuid))
+        return self._edges[edge]
+
+
+    def key(self, edge: Edge) -> tuple:
+        return (self.node(edge.subject), edge.arity, type(edge))
+
+
+    def edges(self, edge_t: type = Edge) -> Iterator[Edge]:
+        for edge in typefilter(self.box.graph.edges, edge_t):
+            if self.box.graph[edge] > self.consumed[edge]:
+                yield edge
+
+
+    @property
+    def nodes(self) -> set:
+        '''
+        The diagram nodes the copy refers to, allocating its fresh internal nodes.
+        '''
+        if '_nodes' not in self.__dict__:
+            self._nodes = set(map(self.node, self.scope))
+        return self._nodes
+
+
+    @property
+    def empty(self) -> bool:
+        return len(self.consumed) == len(self.box.graph)
+
+
+    @property
+    def graph(self) -> Graph:
+        return Graph([self.edge(edge) for edge in self.box.graph - self.consumed])
+
+
+    def rename(self, sigma: Sigma) -> Sigma:
+        return Sigma(from_dict=[(self.node(a), self.node(b)) for a, b in sigma.items()])
+
+
+    def consume(self, edge: Edge) -> Instance:
+        ret = Instance(self.box, self.internals, self.scope, self.names, self.uuids,
+                       self.consumed + {edge})
+        ret._edges = self._edges
+        return ret
+
+
+    def substitute(self, sigma: Sigma, renamed: dict) -> Instance:
+        # NOTE: renamed memoises the substituted copy of each shared names table
+        if id(self.names) not in renamed:
+            fresh = (sigma.domain & self.scope) - self.internals - self.names.keys()
+            if not fresh and sigma.domain.isdisjoint(self.names.values()):
+                renamed[id(self.names)] = self.names
+            else:
+                names = {node: sigma.get(name, name) for node, name in self.names.items()}
+                names.update((node, sigma[node]) for node in fresh)
+                renamed[id(self.names)] = names
+        names = renamed[id(self.names)]
+        if names is self.names:
+            return self
+        return Instance(self.box, self.internals, self.scope, names, self.uuids, self.consumed)
 
 
 
@@ -365,96 +682,197 @@ class Diagram(pair):
     A solo diagram SD is a pair (G, M) where:
         G is a graph: graph = multiset<edge>,
         M is a finite multiset of boxes: box = pair<graph, set<node>>
+    Box copies made by reduction are held as instances and only merged into G
+    when the graph is asked for. Redexes are looked up through the ports of the
+    local graph and of the instances, and a step only replaces the instances it
+    consumes from or substitutes into.
     '''
 
-    def __init__(self, *args) -> None:
-        graph, boxes = self
-        for box in boxes:
-            assert (graph.nodes - box.internals).isdisjoint(box.internals)
-        self.graph = graph
+    def __new__(cls, *args, instances: Iterable[Instance] = (), fused: Map = None) -> Diagram:
+        return super().__new__(cls, *args)
+
+
+    def __init__(self, *args, instances: Iterable[Instance] = (), fused: Map = None) -> None:
+        local, boxes = self
+        self.local = local
         self.boxes = boxes
+        self.instances = set(instances)
+        self.fused = fused if fused is not None else Map()
+
+
+    @property
+    def graph(self) -> Graph:
+        if '_graph' not in self.__dict__:
+            graph = self.local.combine(*(instance.graph for instance in self.instances))
+            graph._uuid = self.local._uuid
+            self._graph = graph
+        return self._graph
+
+
+    @property
+    def ports(self) -> dict:
+        '''
+        Incidence index of the remaining instance edges as (instance, edge) pairs
+        keyed by their (subject, arity, polarity) as renamed into the diagram.
+        '''
+        if '_ports' not in self.__dict__:
+            ports: dict = {}
+            for instance in self.instances:
+                for edge in instance.edges():
+                    ports.setdefault(instance.key(edge), []).append((instance, edge))
+            self._ports = ports
+        return self._ports
+
+
+    @property
+    def incidence(self) -> dict:
+        '''
+        Incidence index from each node to the instances referring to it.
+        '''
+        if '_incidence' not in self.__dict__:
+            incidence: dict = {}
+            for instance in self.instances:
+                for node in instance.nodes:
+                    incidence.setdefault(node, []).append(instance)
+            self._incidence = incidence
+        return self._incidence
+
+
+    def edge(self, instance: Instance, edge: Edge) -> Edge:
+        return edge if instance is None else instance.edge(edge)
+
+
+    def keys(self, edge_t: type) -> set:
+        '''
+        The keys of the top level edges of the given polarity.
+        '''
+        return set(key for index in (self.local.ports, self.ports) for key in index
+                   if key[2] is edge_t)
+
+
+    def matches(self, key: tuple) -> Iterator[tuple]:
+        '''
+        The top level edges under the given key as (instance, edge) pairs,
+        where the instance is None for edges of the local graph.
+        '''
+        for edge in self.local.ports.get(key, []):
+            yield None, edge
+        yield from self.ports.get(key, [])
+
+
+    def fire(self, sigma: Sigma, consumed: list, copies: list = []) -> Diagram:
+        local, touched = self.local, {}
+        for instance, edge in consumed:
+            if instance is None:
+                local = local.replace([edge], [])
+            else:
+                touched[instance] = touched.get(instance, instance).consume(edge)
+        for node in sigma.domain:
+            for instance in self.incidence.get(node, []):
+                touched.setdefault(instance, instance)
+        renamed: dict = {}
+        added = [instance.substitute(sigma, renamed) for instance in list(touched.values()) + copies]
+        added = [instance for instance in added if not instance.empty]
+        ret = Diagram((sigma(local), sigma(self.boxes)),
+                      instances=self.instances.difference(touched).union(added), fused=sigma)
+        # NOTE: only the instances replaced by the step are reindexed
+        if '_ports' in self.__dict__:
+            ret._ports = carry(self._ports,
+                               [(instance, edge) for instance in touched for edge in instance.edges()],
+                               [(instance, edge) for instance in added for edge in instance.edges()],
+                               lambda item: [item[0].key(item[1])])
+        if '_incidence' in self.__dict__:
+            ret._incidence = carry(self._incidence, touched, added, lambda instance: instance.nodes)
+        return ret
+
 
     def reduce(self):
         # NOTE: edge-edge reduction
-        for alpha, beta in ((alpha, beta)
-                            for alpha in typefilter(self.graph.edges, Input)
-                            for beta in  typefilter(self.graph.edges, Output)):
-            try:
-                sigma = Sigma(alpha, beta)
-                assert alpha.subject == beta.subject
-                graph = Graph(self.graph - {alpha, beta})
-                boxes = self.boxes
-                return Diagram((sigma(graph), sigma(boxes)))
-            except:
-                pass
-
+        for (i, alpha), (j, beta) in ((a, b)
+                                      for key in self.keys(Input)
+                                      for b in self.matches(key[:2] + (Output,))
+                                      for a in self.matches(key)):
+            sigma = Sigma.from_edges(self.edge(i, alpha), self.edge(j, beta))
+            if sigma is None:
+                continue
+            return self.fire(sigma, [(i, alpha), (j, beta)])
+
+        # NOTE: the box rules never fire on a trivial sigma
         # NOTE: edge-box reduction
+        for (i, alpha), box, beta in ((a, box, beta)
+                                      for Io in {Input, Output}
+                                      for key in self.keys(Io)
+                                      for box, beta in self.boxes.ports.get(
+                                          key[:2] + (Io.inverse,), [])
+                                      for a in self.matches(key)):
+            sigma = Sigma.from_edges(self.edge(i, alpha), beta)
+            if not sigma:
+                continue
+            copy = Instance(box).consume(beta)
+            return self.fire(copy.rename(sigma), [(i, alpha)], [copy])
+
+        # NOTE: internal box reduction
         for alpha, beta, box in ((alpha, beta, box)
                                  for Io in {Input, Output}
-                                 for alpha in typefilter(self.graph.edges, Io)
                                  for box in self.boxes
-                                 for beta in typefilter(box.graph.edges, Io.inverse)):
-            try:
-                rho = Rho(box.internals)
-                sigma = rho(Sigma(alpha, beta))
-                ag = self.graph - {alpha}
-                bg = box.graph - {beta}
-                graph = Graph(ag + rho(bg))
-                boxes = self.boxes
-                return Diagram((sigma(graph), sigma(boxes)))
-            except:
-                pass
-
-        # NOTE: internal box reduction
-        for alpha, beta in ((alpha, beta)
-                            for Io in {Input, Output}
-                            for box in self.boxes
-                            for alpha in typefilter(box.graph.edges, Io)
-                            for beta in typefilter(box.graph.edges, Io.inverse)):
-            try:
-                rho = Rho(box.internals)
-                sigma = rho(Sigma(alpha, beta))
-                ag = self.graph
-                bg = box.graph - {alpha, beta}
-                graph = Graph(ag + rho(bg))
-                boxes = self.boxes
-                return Diagram((sigma(graph), sigma(boxes)))
-            except:
-                pass
-
-        # NOTE: box-box reduction
+                                 for alpha in typefilter(box.graph.edges, Io)
+                                 for beta in box.graph.ports.get((alpha.subject, alpha.arity,
+                                                                  Io.inverse), [])):
+            sigma = Sigma.from_edges(alpha, beta)
+            if not sigma:
+                continue
+            copy = Instance(box).consume(alpha).consume(beta)
+            return self.fire(copy.rename(sigma), [], [copy])
+
+        # NOTE: box-box reduction, a box only meets an equal box if it has a copy
         for alpha, beta, abox, bbox in ((alpha, beta, abox, bbox)
                                         for Io in {Input, Output}
                                         for abox in self.boxes
                                         for alpha in typefilter(abox.graph.edges, Io)
-                                        for bbox in self.boxes - {abox}
-                                        for beta in typefilter(bbox.graph.edges, Io.inverse)):
-            try:
-                rho = Rho(abox.internals | bbox.internals)
-                sigma = rho(Sigma(alpha, beta))
-                g = self.graph
-                ag = abox.graph - {alpha}
-                bg = bbox.graph - {beta}
-                graph = Graph(g + rho(ag) + rho(bg))
-                boxes = self.boxes
-                return Diagram((sigma(graph), sigma(boxes)))
-            except:
-                pass
+                                        for bbox, beta in self.boxes.ports.get((alpha.subject, alpha.arity,
+                                                                                Io.inverse), [])
+                                        if bbox != abox or self.boxes[abox] > 1):
+            sigma = Sigma.from_edges(alpha, beta)
+            if not sigma:
+                continue
+            internals, scope, names = abox.internals | bbox.internals, abox.nodes | bbox.nodes, {}
+            acopy = Instance(abox, internals, scope, names).consume(alpha)
+            bcopy = Instance(bbox, internals, scope, names).consume(beta)
+            return self.fire(acopy.rename(sigma), [], [acopy, bcopy])
         return self
 
 
     @property
     def nodes(self) -> set:
-        return self.graph.nodes | self.boxes.nodes
+        if '_nodes' not in self.__dict__:
+            self._nodes = self.graph.nodes | self.boxes.nodes
+        return self._nodes
 
 
     @property
     def json(self) -> dict:
-        return {'graph': Graph(self.graph - multiset((box.graph for box in self.boxes))).json,
+        return {'graph': self.graph.json,
                 'boxes': self.boxes.json}
 
 
+    def diff(self, other: Diagram) -> dict:
+        '''
+        The patch taking the json of this diagram to the json of other.
+        Nodes fused by the step from this diagram to other are listed as renamed.
+        '''
+        old, new = self.graph, other.graph
+        old_nodes = old.nodes | {edge._node for edge in old.edges}
+        new_nodes = new.nodes | {edge._node for edge in new.edges}
+        return {'graph': {'nodes': {'added': [node.json for node in new_nodes - old_nodes],
+                                    'removed': [node._uuid for node in old_nodes - new_nodes],
+                                    'renamed': [[a._uuid, b._uuid] for a, b in other.fused.items()
+                                                if a in old_nodes and a not in new_nodes]},
+                          'edges': patch(old, new)},
+                'boxes': patch(self.boxes, other.boxes)}
+
+
     @staticmethod
-    def from_json(json: dict, nodes: dict = {}) -> Diagram:
+    def from_json(json: dict, nodes: dict = None) -> Diagram:
+        nodes = {} if nodes is None else nodes
         return Diagram((Graph.from_json(json['graph'], nodes),
                         Boxes.from_json(json['boxes'], nodes)))
@@ -1,5 +1,9 @@
 #! /usr/bin/env python3
 
+from collections import OrderedDict
+from queue import Full, Queue
+from threading import Event, Lock, Thread
+from time import monotonic
 from types import MethodType
 
 from flask import Flask, request, Response, make_response
@@ -7,7 +11,8 @@ from flask.json import dumps, loads
 from flask_restful import Api, Resource
 from flask_cors import CORS
 
-from diagrams import Diagram
+from diagrams import ids, Diagram
+from store import Store
 from tests import big_diagram
 
 app = Flask(__name__)
@@ -23,6 +28,36 @@ def api_route(self, *args, **kwargs):
 api.route = MethodType(api_route, api)
 
 
+# NOTE: the diagrams most recently handed out, so that their next step can be sent as a patch,
+#       held packed while idle, each request reduces and renders a copy of its own
+kept: OrderedDict = OrderedDict()
+kept_lock = Lock()
+KEPT = 64
+
+
+def keep(diagram: Diagram) -> str:
+    store = Store.from_diagram(diagram)
+    with kept_lock:
+        token = ids.render(ids())
+        kept[token] = store
+        if len(kept) > KEPT:
+            kept.popitem(last=False)
+    return token
+
+
+def lookup(token: str) -> Diagram:
+    with kept_lock:
+        if token not in kept:
+            return None
+        kept.move_to_end(token)
+        store = kept[token]
+    return store.diagram()
+
+
+def snapshot(diagram: Diagram) -> dict:
+    return dict(diagram.json, id=keep(diagram))
+
+
 
 @api.route('/')
 class ReduceRequestHandler(Resource):
@@ -32,13 +67,283 @@ class ReduceRequestHandler(Resource):
 
 
     def get(self) -> Response:
-        return make_response(dumps(big_diagram().json), 200)
+        return make_response(dumps(snapshot(big_diagram())), 200)
 
 
     def post(self):
         diagram = Diagram.from_json(loads(request.data))
         reduction = diagram.reduce()
-        return make_response(dumps(reduction.json), 200)
+        return make_response(dumps(snapshot(reduction)), 200)
+
+
+
+@api.route('/diff/<string:token>')
+class DiffRequestHandler(Resource):
+    '''
+    GET resends the full snapshot of a kept diagram, POST reduces it one step
+    and answers with the patch from it to its reduction.
+    '''
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+
+
+    def get(self, token: str) -> Response:
+        diagram = lookup(token)
+        if diagram is None:
+            return make_response(dumps({'error': 'unknown diagram, resync with POST /'}), 404)
+        return make_response(dumps(dict(diagram.json, id=token)), 200)
+
+
+    def post(self, token: str) -> Response:
+        diagram = lookup(token)
+        if diagram is None:
+            return make_response(dumps({'error': 'unknown diagram, resync with POST /'}), 404)
+        reduction = diagram.reduce()
+        patch = diagram.diff(reduction)
+        # NOTE: a diagram in normal form answers with an empty patch under its own token
+        step = token if reduction is diagram else keep(reduction)
+        return make_response(dumps(dict(patch, id=step, base=token)), 200)
+
+
+
+class Session:
+    '''
+    A diagram reduced in place over several requests.
+    The diagram before the last reduction is kept, with its revision as base,
+    so that the reduction can be resent as a patch.
+    '''
+
+    def __init__(self, diagram: Diagram) -> None:
+        self.diagram = diagram
+        self.previous = diagram
+        self.revision = 0
+        self.base = 0
+        self.lock = Lock()
+        self.touched = monotonic()
+
+
+    def reduce(self, steps: int) -> int:
+        '''
+        Reduce up to the given number of steps, returning how many were taken.
+        '''
+        taken, diagram = 0, self.diagram
+        while taken < steps:
+            reduction = diagram.reduce()
+            if reduction is diagram:
+                break
+            taken, diagram = taken + 1, reduction
+        self.previous, self.diagram = self.diagram, diagram
+        self.touched = monotonic()
+        self.base, self.revision = self.revision, self.revision + taken
+        return taken
+
+
+
+class Sessions:
+    '''
+    Sessions by id, least recently used first. Sessions idle for longer than
+    ttl seconds are evicted, as are the oldest beyond maxsize.
+    '''
+
+    def __init__(self, maxsize: int = 256, ttl: float = 600.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sessions: OrderedDict = OrderedDict()
+        self.lock = Lock()
+
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+
+    def evict(self) -> None:
+        expiry = monotonic() - self.ttl
+        while self.sessions and (len(self.sessions) > self.maxsize
+                                 or next(iter(self.sessions.values())).touched < expiry):
+            self.sessions.popitem(last=False)
+
+
+    def create(self, diagram: Diagram) -> str:
+        sid = ids.render(ids())
+        with self.lock:
+            self.sessions[sid] = Session(diagram)
+            self.evict()
+        return sid
+
+
+    def get(self, sid: str) -> Session:
+        with self.lock:
+            self.evict()
+            session = self.sessions.get(sid)
+            if session is not None:
+                session.touched = monotonic()
+                self.sessions.move_to_end(sid)
+        return session
+
+
+    def delete(self, sid: str) -> bool:
+        with self.lock:
+            return self.sessions.pop(sid, None) is not None
+
+
+sessions = Sessions()
+MAX_STEPS = 10000
+STREAM_BUFFER = 8
+
+
+def session_json(sid: str, session: Session, form: str) -> dict:
+    if form == 'diff':
+        json = session.previous.diff(session.diagram)
+    else:
+        json = session.diagram.json
+    return dict(json, id=sid, revision=session.revision, base=session.base, format=form)
+
+
+
+@api.route('/sessions')
+class SessionsRequestHandler(Resource):
+    '''
+    POST creates a session from a diagram, the example diagram if the body is empty.
+    '''
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+
+
+    def post(self) -> Response:
+        try:
+            diagram = Diagram.from_json(loads(request.data)) if request.data else big_diagram()
+        except Exception as error:
+            return make_response(dumps({'error': 'malformed diagram: %s' % error}), 400)
+        sid = sessions.create(diagram)
+        session = sessions.get(sid)
+        return make_response(dumps(session_json(sid, session, 'snapshot')), 201)
+
+
+
+@api.route('/sessions/<string:sid>')
+class SessionRequestHandler(Resource):
+    '''
+    GET fetches the diagram of a session, as a snapshot or as the patch of its last step.
+    POST reduces it ?steps=n times, or to normal form with ?normal within a budget of
+    ?max_steps, answering with a patch or a snapshot as asked by ?format.
+    DELETE ends the session.
+    '''
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+
+
+    def get(self, sid: str) -> Response:
+        session = sessions.get(sid)
+        if session is None:
+            return make_response(dumps({'error': 'unknown session'}), 404)
+        form = request.args.get('format', 'snapshot')
+        if form not in ('snapshot', 'diff'):
+            return make_response(dumps({'error': 'format must be snapshot or diff'}), 400)
+        with session.lock:
+            return make_response(dumps(session_json(sid, session, form)), 200)
+
+
+    def post(self, sid: str) -> Response:
+        session = sessions.get(sid)
+        if session is None:
+            return make_response(dumps({'error': 'unknown session'}), 404)
+        form = request.args.get('format', 'diff')
+        try:
+            budget = min(int(request.args.get('max_steps', MAX_STEPS)), MAX_STEPS)
+            steps = budget if 'normal' in request.args else int(request.args.get('steps', 1))
+        except ValueError:
+            return make_response(dumps({'error': 'steps and max_steps must be integers'}), 400)
+        if form not in ('snapshot', 'diff') or not 0 <= steps <= budget:
+            return make_response(dumps({'error': 'steps must be within 0 and %d, format '
+                                                  'snapshot or diff' % budget}), 400)
+        with session.lock:
+            taken = session.reduce(steps)
+            json = session_json(sid, session, form)
+        return make_response(dumps(dict(json, steps=taken, normal=taken < steps)), 200)
+
+
+    def delete(self, sid: str) -> Response:
+        if not sessions.delete(sid):
+            return make_response(dumps({'error': 'unknown session'}), 404)
+        return make_response('', 204)
+
+
+
+def reduce_stream(sid: str, session: Session, steps: int, interval: float,
+                  events: Queue, cancel: Event) -> None:
+    '''
+    Reduce a session one step at a time, queueing the patch of each step until
+    normal form, the step budget or cancellation. The bounded queue holds the
+    reduction back while the client is slow to read.
+    '''
+    def put(name: str, data: dict) -> bool:
+        while not cancel.is_set():
+            try:
+                events.put((name, data), timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    try:
+        normal = False
+        for _ in range(steps):
+            with session.lock:
+                normal = not session.reduce(1)
+                patch = session_json(sid, session, 'diff')
+            if normal or not put('step', patch) or cancel.wait(interval):
+                break
+        put('end', {'id': sid, 'revision': session.revision, 'normal': normal})
+    except Exception as error:
+        put('failure', {'id': sid, 'error': str(error)})
+
+
+def server_sent(events: Queue, cancel: Event):
+    # NOTE: closing the generator, as the server does when the client goes away, cancels the worker
+    try:
+        while True:
+            name, data = events.get()
+            yield 'event: %s\nid: %s\ndata: %s\n\n' % (name, data.get('revision', ''), dumps(data))
+            if name != 'step':
+                return
+    finally:
+        cancel.set()
+
+
+
+@api.route('/sessions/<string:sid>/stream')
+class StreamRequestHandler(Resource):
+    '''
+    GET reduces a session in the background, streaming each step as a patch in
+    a server-sent 'step' event, up to ?max_steps and ?interval seconds apart.
+    The stream finishes with an 'end' event, or a 'failure' event.
+    '''
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+
+
+    def get(self, sid: str) -> Response:
+        session = sessions.get(sid)
+        if session is None:
+            return make_response(dumps({'error': 'unknown session'}), 404)
+        try:
+            steps = min(int(request.args.get('max_steps', MAX_STEPS)), MAX_STEPS)
+            interval = min(float(request.args.get('interval', 0)), 10.0)
+        except ValueError:
+            return make_response(dumps({'error': 'max_steps and interval must be numbers'}), 400)
+        events, cancel = Queue(STREAM_BUFFER), Event()
+        Thread(target=reduce_stream, args=(sid, session, steps, interval, events, cancel),
+               name='stream-%s' % sid, daemon=True).start()
+        response = Response(server_sent(events, cancel), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache'})
+        # NOTE: the generator's own cleanup only runs once it has started, a client
+        #       gone before the first event is caught when the response is closed
+        response.call_on_close(cancel.set)
+        return response
 
 
 
@@ -0,0 +1,133 @@
+#! /usr/bin/env python3
+
+from __future__ import annotations
+from array import array
+from collections.abc import Iterator
+from typing import Dict, List
+
+from diagrams import ids, Node, Edge, Input, Output, Graph, Box, Boxes, Diagram
+
+
+class Store:
+    '''
+    A solo diagram packed into typed arrays.
+    Nodes are rows of a name table and edges are rows of a CSR layout over
+    node rows, subject first. The edge rows are split into segments, the top
+    level graph followed by one segment per distinct box.
+    Node, Edge, Box and Diagram objects are built afresh on each call and never
+    cached, so that a diagram held in a store stays packed. The server holds the
+    diagrams it has handed out this way.
+    '''
+
+    def __init__(self) -> None:
+        self.symbols: List[str] = []
+        self.node_names = array('i')        # symbol of each node row, -1 if unnamed
+        self.node_ids = array('q')          # counter id of each node row, -1 if foreign
+        self.edge_ids = array('q')          # counter id of each edge row, -1 if foreign
+        self.foreign: Dict[tuple, str] = {} # ids from other sessions by (table, row)
+        self.polarity = array('b')          # 1 for input edges, 0 for output edges
+        self.offsets = array('I', [0])      # start of each edge row in targets
+        self.targets = array('I')           # node rows of the edges
+        self.segments = array('I', [0])     # start of each segment in the edge rows
+        self.counts = array('I')            # multiplicity of each box
+        self.box_ids = array('q')           # counter id of each box, -1 if foreign
+        self.box_graph_ids = array('q')     # counter id of the graph of each box, -1 if foreign
+        self.internal_offsets = array('I', [0])
+        self.internals = array('I')         # internal node rows of each box
+        self.graph_id = None
+        self.boxes_id = None
+
+
+    def __len__(self) -> int:
+        return len(self.polarity)
+
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.node_names, self.node_ids, self.edge_ids, self.polarity, self.offsets,
+                  self.targets, self.segments, self.counts, self.box_ids, self.box_graph_ids,
+                  self.internal_offsets, self.internals)
+        return sum(a.itemsize * len(a) for a in arrays)
+
+
+    def _uuid(self, table: str, ints: array, uuid) -> None:
+        uuid = ids.parse(uuid)
+        if isinstance(uuid, str):
+            self.foreign[(table, len(ints))] = uuid
+            uuid = -1
+        ints.append(uuid)
+
+
+    @staticmethod
+    def from_diagram(diagram: Diagram) -> Store:
+        store, rows, symbols = Store(), {}, {}
+
+        def row(node: Node) -> int:
+            if node not in rows:
+                rows[node] = len(rows)
+                store.node_names.append(symbols.setdefault(node.name, len(symbols))
+                                        if node.named else -1)
+                store._uuid('node', store.node_ids, node._uuid)
+            return rows[node]
+
+        def segment(graph: Graph) -> None:
+            for edge in graph:
+                store.polarity.append(isinstance(edge, Input))
+                store._uuid('edge', store.edge_ids, edge._uuid)
+                store.targets.extend(map(row, edge))
+                store.offsets.append(len(store.targets))
+            store.segments.append(len(store.polarity))
+
+        segment(diagram.graph)
+        for box, count in diagram.boxes.items():
+            segment(box.graph)
+            store.counts.append(count)
+            store._uuid('box', store.box_ids, box._uuid)
+            store._uuid('box graph', store.box_graph_ids, box.graph._uuid)
+            store.internals.extend(map(row, box.internals))
+            store.internal_offsets.append(len(store.internals))
+        store.symbols = list(symbols)
+        store.graph_id = ids.parse(diagram.graph._uuid)
+        store.boxes_id = ids.parse(diagram.boxes._uuid)
+        return store
+
+
+    def node(self, i: int) -> Node:
+        name = self.node_names[i]
+        uuid = self.node_ids[i]
+        return Node(self.symbols[name] if name >= 0 else None,
+                    ids.render(uuid) if uuid >= 0 else self.foreign[('node', i)])
+
+
+    def edge(self, j: int, nodes: List[Node] = None) -> Edge:
+        node = nodes.__getitem__ if nodes is not None else self.node
+        uuid = self.edge_ids[j]
+        return (Input if self.polarity[j] else Output)(
+            map(node, self.targets[self.offsets[j]:self.offsets[j + 1]]),
+            uuid=uuid if uuid >= 0 else self.foreign[('edge', j)])
+
+
+    def edges(self, k: int = 0, nodes: List[Node] = None) -> Iterator[Edge]:
+        '''
+        Views of the edges in segment k, the top level graph by default.
+        '''
+        for j in range(self.segments[k], self.segments[k + 1]):
+            yield self.edge(j, nodes)
+
+
+    def box(self, k: int, nodes: List[Node] = None) -> Box:
+        node = nodes.__getitem__ if nodes is not None else self.node
+        internals = self.internals[self.internal_offsets[k]:self.internal_offsets[k + 1]]
+        uuid, graph_uuid = self.box_ids[k], self.box_graph_ids[k]
+        graph = Graph(self.edges(k + 1, nodes),
+                      uuid=graph_uuid if graph_uuid >= 0 else self.foreign[('box graph', k)])
+        return Box((graph, frozenset(map(node, internals))),
+                   uuid=uuid if uuid >= 0 else self.foreign[('box', k)])
+
+
+    def diagram(self) -> Diagram:
+        # NOTE: one view per node row, so that boxes set the group of shared nodes
+        nodes = [self.node(i) for i in range(len(self.node_names))]
+        boxes = {self.box(k, nodes): count for k, count in enumerate(self.counts)}
+        return Diagram((Graph(self.edges(0, nodes), uuid=self.graph_id),
+                        Boxes(boxes, uuid=self.boxes_id)))
@@ -1,10 +1,14 @@
 #! /usr/bin/env python3
 
 from functools import reduce
-from json import dumps
+import gc
+from json import dumps, loads
+import sys
+from time import perf_counter
 import unittest
 
-from diagrams import Node, Input, Output, Graph, Box, Boxes, Map, Diagram
+from diagrams import typefilter, ids, pool, Node, Input, Output, Graph, Box, Boxes, Map, Sigma, Diagram
+from store import Store
 
 
 def big_diagram():
@@ -34,6 +38,40 @@ def big_diagram():
     return d
 
 
+def linked(json: dict) -> dict:
+    # NOTE: d3's forceLink swaps link endpoint ids for the node objects
+    def link(graph):
+        nodes = {node['id']: node for node in graph['nodes']}
+        for edge in graph['edges']:
+            for l in edge:
+                l['source'], l['target'] = nodes[l['source']], nodes[l['target']]
+    link(json['graph'])
+    for box in json['boxes']:
+        link(box['graph'])
+    return json
+
+
+def apply_patch(json: dict, patch: dict) -> dict:
+    # NOTE: mirrors applyPatch in graph.js
+    def apply(items, patch, key):
+        for uuid in patch['removed']:
+            items.remove(next(item for item in items if key(item) == uuid))
+        for item in patch['renamed']:
+            items[next(i for i, old in enumerate(items) if key(old) == key(item))] = item
+        items.extend(patch['added'])
+    # NOTE: renamed nodes are listed among the removed, the pairs only guide the layout
+    apply(json['graph']['nodes'], dict(patch['graph']['nodes'], renamed=[]), lambda node: node['id'])
+    apply(json['graph']['edges'], patch['graph']['edges'], lambda edge: edge[0]['id'])
+    apply(json['boxes'], patch['boxes'], lambda box: box['id'])
+    return json
+
+
+def canonical(json: dict) -> tuple:
+    return (sorted(dumps(node, sort_keys=True) for node in json['graph']['nodes']),
+            sorted(dumps(edge, sort_keys=True) for edge in json['graph']['edges']),
+            sorted(dumps(box, sort_keys=True) for box in json['boxes']))
+
+
 
 class TestDiagrams(unittest.TestCase):
 
@@ -44,6 +82,267 @@ class TestDiagrams(unittest.TestCase):
             file.write(dumps(reduce(lambda d, _: d.reduce(), range(0), d).json))
 
 
+    def test_redex_index(self):
+        u, v, x, y, z = Node('u'), Node('v'), Node('x'), Node('y'), Node()
+        g = Graph([Input((u, x)), Output((v, y)), Output((u, z))])
+        assert len(g.ports[(u, 1, Output)]) == 1 and (v, 1, Input) not in g.ports
+        assert Sigma.from_edges(Input((u, x)), Output((u, y))) is None
+        assert Sigma.from_edges(Input((u, x)), Output((u, z))) == {z: x}
+        d = Diagram((g, Boxes()))
+        r = d.reduce()
+        assert r is not d and len(r.graph) == 1
+        assert r.reduce() is r
+
+
+    def test_cached_nodes(self):
+        d = big_diagram()
+        assert d.graph.nodes is d.graph.nodes and d.nodes is d.nodes
+        assert d.graph.nodes == reduce(lambda a, b: a | b, (e.nodes for e in d.graph), frozenset())
+        assert all(edge in d.graph.incidence[node] for edge in d.graph for node in edge)
+        assert d.boxes.principals == frozenset().union(*(b.nodes - b.internals for b in d.boxes))
+        assert d.boxes.internals.isdisjoint(d.boxes.principals)
+
+
+    def test_local_substitution(self):
+        d = big_diagram()
+        for node in d.nodes:
+            d.graph.incidence, d.boxes.incidence
+            sigma = Sigma(from_dict={node: Node('w')})
+            graph, boxes = sigma(d.graph), sigma(d.boxes)
+            assert graph == Map.__call__(sigma, d.graph)
+            assert boxes == Map.__call__(sigma, d.boxes)
+            assert {n: set(es) for n, es in graph.incidence.items()} \
+                == {n: set(es) for n, es in Graph(graph).incidence.items()}
+            assert (graph is d.graph) == (node not in d.graph.nodes)
+            assert (boxes is d.boxes) == (node not in d.boxes.nodes)
+
+
+    def test_lazy_instances(self):
+        u, v, a, b, n = Node('u'), Node('v'), Node('a'), Node(), Node()
+        box = Box((Graph([Output((u, n)), Output((v, n))]), frozenset({n})))
+        d = Diagram((Graph([Input((u, a)), Input((v, b))]), Boxes([box])))
+        d1 = d.reduce()
+        (instance,) = d1.instances
+        assert len(d1.local) == 1 and not instance._edges
+        (i,), (o,) = typefilter(d1.graph, Input), typefilter(d1.graph, Output)
+        assert i.subject == o.subject and n not in d1.graph.nodes
+        d2 = d1.reduce()
+        assert len(d2.graph) == 0 and d2.boxes == d.boxes and not d2.instances
+        dumps(d1.json)
+
+
+    def test_step_cost(self):
+        # NOTE: big_diagram fires its internal box every step, so copies pile up untouched
+        def elapsed(d, steps):
+            started = perf_counter()
+            for _ in range(steps):
+                d = d.reduce()
+            return d, perf_counter() - started
+
+        d, _ = elapsed(big_diagram(), 100)
+        d, early = elapsed(d, 100)
+        d, _ = elapsed(d, 800)
+        d, late = elapsed(d, 100)
+        print('%d copies, early %.4fs, late %.4fs' % (len(d.instances), early, late))
+        assert len(d.instances) > 900 and late < 3 * early
+        fresh = Diagram((d.local, d.boxes), instances=d.instances)
+        assert {key: set(items) for key, items in d.ports.items()} \
+            == {key: set(items) for key, items in fresh.ports.items()}
+
+
+    def test_compact_ids(self):
+        d = big_diagram()
+        edges = list(d.graph.distinct_elements())
+        assert all(isinstance(edge._uuid, int) for edge in edges)
+        assert len({edge._uuid for edge in edges}) == len(edges)
+        assert all(node.startswith(ids.prefix) for node in d.nodes if not node.named)
+        json = d.json
+        assert all(isinstance(node['id'], str) for node in json['graph']['nodes'])
+        r = Diagram.from_json(linked(json), {})
+        assert {node._uuid for node in r.nodes} == {node._uuid for node in d.nodes}
+        assert Node() not in r.nodes
+
+
+    def test_packed_store(self):
+        d = reduce(lambda d, _: d.reduce(), range(5), big_diagram())
+        store = Store.from_diagram(d)
+        assert len(store) == len(d.graph) + sum(len(box.graph) for box in d.boxes.distinct_elements())
+        r = store.diagram()
+        assert r == Diagram((d.graph, d.boxes))
+        assert {node: node.group for node in r.nodes} == {node: node.group for node in d.nodes}
+        assert [edge._uuid for edge in r.graph] == [edge._uuid for edge in d.graph]
+        assert canonical(r.json) == canonical(d.json)
+        foreign = Diagram((Graph([Input((Node('x', 'abc'), Node(None, 'def')))], uuid='ghi'), Boxes()))
+        r = Store.from_diagram(foreign).diagram()
+        assert r == foreign and r.graph._uuid == 'ghi' and Node(None, 'def') in r.nodes
+
+
+    def test_diff(self):
+        d = big_diagram()
+        json = d.json
+        for _ in range(6):
+            r = d.reduce()
+            patch = d.diff(r)
+            json = apply_patch(json, patch)
+            assert canonical(json) == canonical(r.json)
+            d = r
+        u, x, z = Node('u'), Node('x'), Node()
+        d = Diagram((Graph([Input((u, x)), Output((u, z)), Input((x, z))]), Boxes()))
+        patch = d.diff(d.reduce())
+        assert patch['graph']['nodes']['renamed'] == [[z._uuid, x._uuid]]
+        assert len(patch['graph']['edges']['removed']) == 2
+        assert len(patch['graph']['edges']['renamed']) == 1 and not patch['graph']['edges']['added']
+
+
+    def test_diff_endpoint(self):
+        from rest import app, kept
+        client = app.test_client()
+        json = loads(client.get('/').data)
+        assert isinstance(kept[json['id']], Store)
+        for _ in range(4):
+            patch = loads(client.post('/diff/%s' % json['id']).data)
+            assert patch['base'] == json['id']
+            json = apply_patch(json, patch)
+            assert canonical(json) == canonical(loads(client.get('/diff/%s' % patch['id']).data))
+            json['id'] = patch['id']
+        assert client.post('/diff/unknown').status_code == 404
+
+    def test_diff_endpoint_concurrent(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from rest import app
+        client = app.test_client()
+        json = loads(client.get('/').data)
+        for _ in range(3):
+            json['id'] = loads(client.post('/diff/%s' % json['id']).data)['id']
+        # NOTE: steps from one token each reduce a copy unpacked from the same store
+        with ThreadPoolExecutor(8) as pool:
+            patches = list(pool.map(lambda _: loads(client.post('/diff/%s' % json['id']).data),
+                                    range(16)))
+        assert all(patch['base'] == json['id'] for patch in patches)
+        snapshots = [canonical(loads(client.get('/diff/%s' % token).data))
+                     for token in (json['id'], json['id'], patches[0]['id'])]
+        assert snapshots[0] == snapshots[1]
+        assert snapshots[2] == canonical(apply_patch(loads(client.get('/diff/%s' % json['id']).data),
+                                                     patches[0]))
+
+
+    def test_sessions(self):
+        from rest import app, Sessions
+        client = app.test_client()
+        response = client.post('/sessions', data=dumps(big_diagram().json))
+        assert response.status_code == 201
+        json = loads(response.data)
+        sid = json['id']
+        patch = loads(client.post('/sessions/%s?steps=3' % sid).data)
+        assert (patch['steps'], patch['base'], patch['revision']) == (3, 0, 3) and not patch['normal']
+        assert canonical(apply_patch(json, patch)) \
+            == canonical(loads(client.get('/sessions/%s' % sid).data))
+        resent = loads(client.get('/sessions/%s?format=diff' % sid).data)
+        assert all(resent[key] == patch[key] for key in ('graph', 'boxes', 'base', 'revision'))
+        assert client.post('/sessions/%s?steps=100000' % sid).status_code == 400
+        assert client.delete('/sessions/%s' % sid).status_code == 204
+        assert client.post('/sessions/%s' % sid).status_code == 404
+
+        u, x, z = Node('u'), Node('x'), Node()
+        d = Diagram((Graph([Input((u, x)), Output((u, z)), Input((x, z))]), Boxes()))
+        sid = loads(client.post('/sessions', data=dumps(d.json)).data)['id']
+        json = loads(client.post('/sessions/%s?normal&format=snapshot' % sid).data)
+        assert json['normal'] and json['steps'] == 1 and len(json['graph']['edges']) == 1
+
+        sessions = Sessions(maxsize=2)
+        first, *_ = [sessions.create(d) for _ in range(3)]
+        assert len(sessions) == 2 and sessions.get(first) is None
+        sessions.ttl = 0
+        assert sessions.get(sessions.create(d)) is None and len(sessions) == 0
+
+
+    def test_stream(self):
+        from http.client import HTTPConnection
+        from threading import Thread, enumerate as threads
+        from time import sleep
+        from logging import getLogger, ERROR
+        from werkzeug.serving import make_server
+        from rest import app, StreamRequestHandler
+        getLogger('werkzeug').setLevel(ERROR)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        Thread(target=server.serve_forever, daemon=True).start()
+
+        def request(method, path, body=None):
+            connection = HTTPConnection('127.0.0.1', server.server_port)
+            connection.request(method, path, body)
+            return connection, connection.getresponse()
+
+        def events(response):
+            event = {}
+            for line in response:
+                line = line.decode().rstrip('\n')
+                if not line:
+                    yield event['event'], loads(event['data'])
+                    event = {}
+                else:
+                    key, _, value = line.partition(': ')
+                    event[key] = value
+
+        try:
+            _, response = request('POST', '/sessions', dumps(big_diagram().json))
+            json = loads(response.read())
+            _, response = request('GET', '/sessions/%s/stream?max_steps=5' % json['id'])
+            assert response.getheader('Content-Type').startswith('text/event-stream')
+            received = list(events(response))
+            assert [name for name, _ in received] == ['step'] * 5 + ['end']
+            for _, patch in received[:-1]:
+                json = apply_patch(json, patch)
+            _, response = request('GET', '/sessions/%s' % json['id'])
+            assert canonical(json) == canonical(loads(response.read()))
+
+            # NOTE: a client hanging up cancels the reduction behind the stream
+            connection, response = request('GET', '/sessions/%s/stream' % json['id'])
+            assert next(events(response))[0] == 'step'
+            response.close()
+            connection.close()
+            for _ in range(100):
+                if not any(thread.name == 'stream-%s' % json['id'] for thread in threads()):
+                    break
+                sleep(0.05)
+            else:
+                self.fail('stream worker still running')
+
+            # NOTE: as must a client hanging up before the first event
+            sid = loads(request('POST', '/sessions', dumps(big_diagram().json))[1].read())['id']
+            with app.test_request_context('/sessions/%s/stream' % sid):
+                StreamRequestHandler().get(sid).close()
+            for _ in range(100):
+                if not any(thread.name == 'stream-%s' % sid for thread in threads()):
+                    break
+                sleep(0.05)
+            else:
+                self.fail('stream worker still running')
+        finally:
+            server.shutdown()
+
+
+    def test_flat_server_memory(self):
+        from rest import app
+        client = app.test_client()
+
+        def post():
+            u, x, z = Node('u'), Node('x'), Node()
+            d = Diagram((Graph([Input((u, x)), Output((u, z)), Input((x, z))]), Boxes()))
+            response = client.post('/', data=dumps(linked(d.json)), content_type='application/json')
+            assert response.status_code == 200
+
+        # NOTE: the warm up fills the node pool, every request brings fresh nodes
+        for _ in range(2000):
+            post()
+        gc.collect()
+        blocks = sys.getallocatedblocks()
+        for _ in range(10000):
+            post()
+        gc.collect()
+        assert len(pool) <= pool.maxsize
+        assert sys.getallocatedblocks() - blocks < 1000
+
+
 
 if __name__ == '__main__':
     unittest.main()
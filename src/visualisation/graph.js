@@ -208,8 +208,93 @@ function getJSON() {
 }
 getJSON();
 
+function edgeId(edge) {
+    return edge[0].id;
+}
+
+function patchList(list, patch, key) {
+    patch.removed.forEach(function(id) {
+        var i = list.findIndex(function(d) { return key(d) == id; });
+        if (i >= 0) list.splice(i, 1);
+    });
+    patch.renamed.forEach(function(item) {
+        var i = list.findIndex(function(d) { return key(d) == key(item); });
+        if (i >= 0) list[i] = item; else list.push(item);
+    });
+    patch.added.forEach(function(item) { list.push(item); });
+}
+
+function applyPatch(graph, patch) {
+    var nodes = graph.graph.nodes;
+    // fused nodes hand their position on to the node they were renamed to
+    patch.graph.nodes.renamed.forEach(function(pair) {
+        var from = nodes.find(function(d) { return d.id == pair[0]; }),
+            to = patch.graph.nodes.added.find(function(d) { return d.id == pair[1]; });
+        if (from != undefined && to != undefined) {
+            to.x = from.x;
+            to.y = from.y;
+        }
+    });
+    patchList(nodes, {removed: patch.graph.nodes.removed, renamed: [],
+                      added: patch.graph.nodes.added}, function(d) { return d.id; });
+    patchList(graph.graph.edges, patch.graph.edges, edgeId);
+    patchList(graph.boxes, patch.boxes, function(d) { return d.id; });
+    graph.id = patch.id;
+    return graph;
+}
+
 function reduce() {
-    getJSON();
+    if (json == undefined) {
+        getJSON();
+        return;
+    }
+    // the server keeps the diagram, so only the patch for the next step travels
+    jQuery.ajax({
+        type: "POST",
+        url: "http://localhost:8001/diff/" + json.id,
+        cache: false,
+        dataType: "json",
+        success: function(data) { json = applyPatch(json, data); updateData(json); },
+        error: function(xhr) {
+            // the server has forgotten the diagram, resync with the full snapshot
+            if (xhr.status == 404) getJSON(); else alert(xhr.statusText);
+        }
+    });
+}
+
+var source;
+function play() {
+    stop();
+    // the server reduces a session of the current diagram and streams each step as a patch
+    jQuery.ajax({
+        type: "POST",
+        url: "http://localhost:8001/sessions",
+        data: json == undefined ? "" : JSON.stringify(json),
+        cache: false,
+        contentType: "application/json; charset=utf-8",
+        dataType: "json",
+        success: function(data) {
+            json = data;
+            updateData(json);
+            source = new EventSource("http://localhost:8001/sessions/" + data.id + "/stream?interval=0.5");
+            source.addEventListener("step", function(e) {
+                json = applyPatch(json, JSON.parse(e.data));
+                updateData(json);
+            });
+            source.addEventListener("end", stop);
+            source.addEventListener("failure", function(e) { stop(); alert(JSON.parse(e.data).error); });
+            // closing rather than letting EventSource reconnect, which would restart the stream
+            source.onerror = stop;
+        },
+        failure: function(err) { alert(err); }
+    });
+}
+
+function stop() {
+    if (source != undefined) {
+        source.close();
+        source = undefined;
+    }
 }
 
 function dragstarted(d) {